@@ -0,0 +1 @@
+# Benchmarks: synthetic data (corpus) and stage timings (run), see run.py
@@ -0,0 +1,92 @@
+import os
+import codecs
+import numpy as np
+
+# Synthetic data in the data_example format: sentence and frame element files, a lexicon list and a text VSM.
+# Words follow a Zipf distribution, lemma.pos can evoke one or more frames, some of them are missing from the lexicon.
+
+POS_TAGS = [("NN", "n"), ("VB", "v"), ("JJ", "a")]
+LABELS = ["nsubj", "dobj", "prep", "pobj", "det", "amod", "advmod", "dep", "punct", "nn"]
+
+
+class SyntheticData:
+    def __init__(self, num_words=5000, num_frames=300, num_lemmapos=3000, max_ambiguity=3, unknown_rate=0.1,
+                 vsm_coverage=0.9, dim=50, seed=0):
+        self.rng = np.random.RandomState(seed)
+        self.words = ["w%d" % i for i in range(num_words)]
+        self.word_probs = 1. / np.arange(1, num_words + 1)
+        self.word_probs /= self.word_probs.sum()
+        self.frames = ["Frame_%d" % i for i in range(num_frames)]
+        self.dim = dim
+        self.vsm_coverage = vsm_coverage
+        # lemma.pos -> frames, the first num_lemmapos * unknown_rate are kept out of the lexicon
+        self.lemmapos = []
+        self.lexicon = {}
+        for i in range(num_lemmapos):
+            word = self.words[self.rng.randint(num_words)]
+            tag, pos = POS_TAGS[self.rng.randint(len(POS_TAGS))]
+            lemmapos = word + "." + pos
+            if lemmapos in self.lexicon:
+                continue
+            self.lemmapos += [(word, tag, lemmapos)]
+            self.lexicon[lemmapos] = list(self.rng.choice(self.frames, self.rng.randint(1, max_ambiguity + 1), replace=False))
+        self.unknown = set(lemmapos for _, _, lemmapos in self.lemmapos[:int(len(self.lemmapos) * unknown_rate)])
+
+    def write_corpus(self, prefix, num_sentences, min_length=5, max_length=40, max_predicates=3):
+        """ prefix.all.lemma.tags and prefix.frame.elements, returns the number of annotated predicates """
+        num_predicates = 0
+        with codecs.open(prefix + ".all.lemma.tags", "w", "utf-8") as tags, \
+                codecs.open(prefix + ".frame.elements", "w", "utf-8") as fes:
+            for sid in range(num_sentences):
+                n = self.rng.randint(min_length, max_length + 1)
+                tokens = [self.words[i] for i in self.rng.choice(len(self.words), n, p=self.word_probs)]
+                pos = [POS_TAGS[self.rng.randint(len(POS_TAGS))][0] for _ in range(n)]
+                # random tree: every token but the root attaches to a token placed before it in a random order
+                order = self.rng.permutation(n) + 1
+                heads = [0] * (n + 1)
+                for k in range(1, n):
+                    heads[order[k]] = order[self.rng.randint(k)]
+                labels = ["ROOT" if heads[t] == 0 else LABELS[self.rng.randint(len(LABELS))] for t in range(1, n + 1)]
+                for k in range(self.rng.randint(max_predicates + 1)):  # predicates replace a token of the sentence
+                    t = self.rng.randint(n)
+                    word, tag, lemmapos = self.lemmapos[self.rng.randint(len(self.lemmapos))]
+                    tokens[t], pos[t] = word, tag
+                    roles = []
+                    for r in range(self.rng.randint(3)):
+                        start = self.rng.randint(n)
+                        end = min(n - 1, start + self.rng.randint(3))
+                        roles += ["Role_%d" % r, str(start) if start == end else "%d:%d" % (start, end)]
+                    frame = self.lexicon[lemmapos][self.rng.randint(len(self.lexicon[lemmapos]))]
+                    fes.write("\t".join(["0", "0", str(len(roles) / 2), frame, lemmapos, str(t), word, str(sid)] + roles) + "\n")
+                    num_predicates += 1
+                tags.write("\t".join([str(n)] + tokens + pos + labels + [str(heads[t]) for t in range(1, n + 1)] +
+                                     ["O"] * n + [token.lower() for token in tokens]) + "\n")
+        return num_predicates
+
+    def write_lexicon(self, path):  # [frame \t lemmapos], without the unknown lemma.pos
+        with codecs.open(path, "w", "utf-8") as f:
+            for _, _, lemmapos in self.lemmapos:
+                if lemmapos not in self.unknown:
+                    for frame in self.lexicon[lemmapos]:
+                        f.write(frame + "\t" + lemmapos + "\n")
+
+    def write_vsm(self, path):  # [word dim1 dim2 ...] for a part of the vocabulary
+        with codecs.open(path, "w", "utf-8") as f:
+            for word in self.words:
+                if self.rng.rand() < self.vsm_coverage:
+                    f.write(word + " " + " ".join("%.5f" % x for x in self.rng.randn(self.dim)) + "\n")
+
+
+def generate(root, num_train=2000, num_test=500, seed=0, **kwargs):
+    """ Synthetic data in the ResourceManager folder structure under root:
+        corpora bench-train and bench-test, lexicon bench-lexicon and VSM bench-vsm.txt """
+    data = SyntheticData(seed=seed, **kwargs)
+    folders = {name: os.path.join(root, "srl_data", name) for name in ["corpora", "lexicons", "embeddings"]}
+    for folder in folders.values():
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+    sizes = {"train_predicates": data.write_corpus(os.path.join(folders["corpora"], "bench-train"), num_train),
+             "test_predicates": data.write_corpus(os.path.join(folders["corpora"], "bench-test"), num_test)}
+    data.write_lexicon(os.path.join(folders["lexicons"], "bench-lexicon"))
+    data.write_vsm(os.path.join(folders["embeddings"], "bench-vsm.txt"))
+    return sizes
@@ -0,0 +1,122 @@
+import os, sys, time, json, shutil, tempfile, argparse, platform
+import numpy as np
+from benchmark.corpus import generate
+from data import get_graphs
+from extras import Lexicon, VSM, get_compiled_vsm
+from representation import DummyMapper, SentenceBowMapper, DependentsBowMapper, get_matrices
+from classifier import CLASSIFIERS
+from instrumentation import cpu_time, peak_rss_mb
+
+# Stage-level benchmark on synthetic data: times parsing, lexicon and VSM loading, featurization, training and
+# prediction for each classifier and mapper, and writes the results as JSON. Run from the package folder:
+#   python -m benchmark.run --train 2000 --test 500 --out benchmark.json
+
+MAPPERS = {m.__name__: m for m in [DummyMapper, SentenceBowMapper, DependentsBowMapper]}
+BASELINES = ["DataMajorityBaseline", "LexiconMajorityBaseline"]  # don't use features, only run with DummyMapper
+
+
+class StageTimer:
+    def __init__(self):
+        self.stages = []
+
+    def measure(self, stage, items, run, **info):
+        """ Run and time one stage, items is the number of processed items (or a function of the result) """
+        start_wall, start_cpu = time.time(), cpu_time()
+        result = run()
+        wall, cpu = time.time() - start_wall, cpu_time() - start_cpu
+        items = items(result) if callable(items) else items
+        record = {"stage": stage, "wall_s": wall, "cpu_s": cpu, "items": items,
+                  "throughput": items / wall if wall > 0 else None, "peak_rss_mb": peak_rss_mb()}
+        record.update(info)
+        self.stages += [record]
+        print >> sys.stderr, "%-24s %-48s %10.3fs %10s items/s" % (stage, " ".join(str(v) for v in info.values()), wall,
+                                                                   "%.1f" % record["throughput"] if record["throughput"] else "-")
+        return result
+
+
+def run(args):
+    root = args.root if args.root is not None else tempfile.mkdtemp(prefix="simpleframeid-bench")
+    timer = StageTimer()
+    sizes = timer.measure("generate", args.train + args.test, lambda: generate(
+        root, args.train, args.test, seed=args.seed, num_words=args.words, num_frames=args.frames,
+        num_lemmapos=args.lemmapos, dim=args.dim))
+    corpora = os.path.join(root, "srl_data", "corpora")
+    lexicon_path = os.path.join(root, "srl_data", "lexicons", "bench-lexicon")
+    vsm_path = os.path.join(root, "srl_data", "embeddings", "bench-vsm.txt")
+
+    graphs = {}
+    for corpus in ["bench-train", "bench-test"]:
+        paths = [os.path.join(corpora, corpus + x) for x in [".all.lemma.tags", ".frame.elements"]]
+        compiled = os.path.join(root, "cache", corpus + ".corpus.npz")
+        graphs[corpus] = timer.measure("parse_corpus", len, lambda: get_graphs(*paths), corpus=corpus)
+        timer.measure("compile_corpus", len, lambda: get_graphs(*paths, compiled=compiled), corpus=corpus)
+        timer.measure("load_compiled_corpus", len, lambda: get_graphs(*paths, compiled=compiled), corpus=corpus)
+
+    def load_lexicon():
+        lexicon = Lexicon()
+        lexicon.load_from_list(lexicon_path)
+        return lexicon
+    lexicon = timer.measure("load_lexicon", lambda l: len(l.frameLexicon), load_lexicon)
+
+    for path in get_compiled_vsm(vsm_path):
+        if os.path.exists(path):
+            os.remove(path)
+    timer.measure("compile_vsm", lambda v: len(v.vocab), lambda: VSM(vsm_path))
+    vsm = timer.measure("load_vsm", lambda v: len(v.vocab), lambda: VSM(vsm_path))
+
+    for corpus in ["bench-train", "bench-test"]:  # all mappers in one pass, compare to the sum of their featurize stages
+        timer.measure("featurize_joint", lambda m: len(m[0][1]),
+                      lambda: get_matrices([MAPPERS[name](vsm, lexicon) for name in args.mappers], graphs[corpus]),
+                      corpus=corpus, mapper=" ".join(args.mappers))
+
+    for mapper_name in args.mappers:
+        mapper = MAPPERS[mapper_name](vsm, lexicon)
+        X_train, y_train, lemmapos_train, _ = timer.measure("featurize", lambda m: len(m[1]),
+                                                            lambda: mapper.get_matrix(graphs["bench-train"]),
+                                                            corpus="bench-train", mapper=mapper_name)
+        X_test, _, lemmapos_test, _ = timer.measure("featurize", lambda m: len(m[1]),
+                                                    lambda: mapper.get_matrix(graphs["bench-test"]),
+                                                    corpus="bench-test", mapper=mapper_name)
+        for clf_name in args.classifiers:
+            if (clf_name in BASELINES) != (mapper_name == "DummyMapper"):
+                continue
+            np.random.seed(args.seed)
+            clf = CLASSIFIERS[clf_name](lexicon, False, args.components, args.max_sampled, args.epochs)
+            timer.measure("train", len(y_train), lambda: clf.train(X_train, y_train, lemmapos_train),
+                          classifier=clf_name, mapper=mapper_name)
+            timer.measure("predict", len(lemmapos_test), lambda: clf.predict_batch(X_test, lemmapos_test),
+                          classifier=clf_name, mapper=mapper_name)
+
+    if args.root is None:
+        shutil.rmtree(root)
+    return {"settings": vars(args), "sizes": sizes, "stages": timer.stages,
+            "environment": {"python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+                            "cpus": os.sysconf("SC_NPROCESSORS_ONLN")}}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stage-level benchmark on synthetic data")
+    parser.add_argument("--root", help="folder for the synthetic data, kept afterwards (default: temporary)")
+    parser.add_argument("--out", default="benchmark.json", help="JSON results, - for stdout")
+    parser.add_argument("--train", type=int, default=2000, help="training sentences")
+    parser.add_argument("--test", type=int, default=500, help="test sentences")
+    parser.add_argument("--words", type=int, default=5000, help="vocabulary size")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--lemmapos", type=int, default=3000, help="number of lemma.pos")
+    parser.add_argument("--dim", type=int, default=50, help="VSM dimension")
+    parser.add_argument("--components", type=int, default=100, help="WSABIE components")
+    parser.add_argument("--max-sampled", type=int, default=10, help="WSABIE negative samples")
+    parser.add_argument("--epochs", type=int, default=10, help="WSABIE epochs")
+    parser.add_argument("--classifiers", nargs="+", default=sorted(CLASSIFIERS.keys()), choices=sorted(CLASSIFIERS.keys()))
+    parser.add_argument("--mappers", nargs="+", default=sorted(MAPPERS.keys()), choices=sorted(MAPPERS.keys()))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    stdout = sys.stdout
+    sys.stdout = sys.stderr  # progress output of the stages
+    results = run(args)
+    if args.out == "-":
+        json.dump(results, stdout, indent=1)
+    else:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=1)
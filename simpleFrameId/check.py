@@ -12,6 +12,7 @@ def check_corpora_read_ok(sources, out):
         g = get_graphs(*sources.get_corpus(corpus), verbose=False)
         reporter = ConllReporter(out+corpus+".conll")
         reporter.report(g)
+        reporter.close()
 
 
 if __name__ == "__main__":
@@ -1,30 +1,186 @@
+import os, json, shutil, time, multiprocessing
 import numpy as np
-from keras.models import Sequential
-from keras.layers.core import Dense
-from keras.utils.np_utils import to_categorical
+import scipy.sparse as sp
 from collections import Counter
 
-from lightfm import LightFM
-# LightFM source code had to be hacked as it is buggy and does not say with which python version it actually should work
-        # aMatrix.tocsr() --> sp.csr_matrix(aMatrix)
-        # aMatrix.tocoo() --> sp.coo_matrix(aMatrix)
-from sklearn.metrics.pairwise import cosine_similarity
+# keras and lightfm are imported when a model is trained, loading a saved model for prediction doesn't need keras.
+# LightFM expects scipy sparse matrices for the interactions and the user features, WsabieClassifier converts them
+
+
+MODEL_FORMAT_VERSION = 1  # increase when the saved parameters of a classifier change
+NUM_THREADS = multiprocessing.cpu_count()  # default number of training threads
+DNN_EPOCHS = 100  # maximum number of epochs of SharingDNNClassifier, the configuration's num_epochs is for WSABIE
+
+
+class TrainingController:
+    """ Epoch loop of the iteratively trained classifiers. A random validation split of the training instances is held
+        out, training stops after patience epochs without improvement of the (lexicon-constrained) validation accuracy
+        or when time_budget seconds are spent, and the classifier is then trained again on all instances for the number
+        of epochs that gave the best validation accuracy. The defaults run all epochs on all instances """
+    def __init__(self, validation_split=0., patience=None, time_budget=None, min_delta=0.):
+        self.validation_split = validation_split
+        self.patience = patience
+        self.time_budget = time_budget
+        self.min_delta = min_delta  # smaller improvements of the validation accuracy don't count
+
+    def __str__(self):  # part of the model and run names, empty for the defaults
+        if self.validation_split == 0. and self.patience is None and self.time_budget is None:
+            return ""
+        return "val_"+str(self.validation_split)+"__pat_"+str(self.patience)+"__tb_"+str(self.time_budget)+\
+               "__md_"+str(self.min_delta)
+
+    def split(self, clf, y, lemmapos_list):
+        """ (training rows, validation rows). Only instances the lexicon doesn't decide are validated on: unambiguous
+            ones are always right, and frames unknown to the lexicon can't be predicted. The others stay in training """
+        num_validation = int(len(y) * self.validation_split)
+        if num_validation == 0:
+            return np.arange(len(y)), np.arange(0)
+        held_out = np.zeros(len(y), dtype=np.bool)
+        held_out[np.random.permutation(len(y))[:num_validation]] = True
+        held_out &= np.asarray(y) >= 0
+        if not clf.all_unknown:  # otherwise every instance can take any frame
+            lemmapos_ids = clf.lexicon.get_lemmapos_ids(lemmapos_list)
+            held_out &= (lemmapos_ids < 0) | clf.lexicon.ambiguous[np.maximum(lemmapos_ids, 0)]
+        return np.flatnonzero(~held_out), np.flatnonzero(held_out)
+
+    def run(self, clf, max_epochs, epoch_runner, X, y, lemmapos_list):
+        """ Train clf for up to max_epochs epochs. epoch_runner(rows) gives a function run_epoch(epoch) that trains clf
+            on these instances for one epoch, from scratch at epoch 0. Returns the training info reported in the summary """
+        train_rows, val_rows = self.split(clf, y, lemmapos_list)
+        X_val, y_val, lemmapos_val = X[val_rows], np.asarray(y)[val_rows], [lemmapos_list[i] for i in val_rows]
+        run_epoch = epoch_runner(train_rows)
+        start_time = time.time()
+        epoch_times = []
+        best_epoch, best_acc = None, None
+        for epoch in range(max_epochs):
+            epoch_start = time.time()
+            run_epoch(epoch)
+            epoch_times += [time.time() - epoch_start]
+            if len(y_val) > 0:
+                val_acc = float(np.mean(clf.predict_batch(X_val, lemmapos_val) == y_val))
+                if best_acc is None or val_acc > best_acc + self.min_delta:
+                    best_epoch, best_acc = epoch, val_acc
+                print "Epoch", epoch + 1, "/", max_epochs, "%.2fs" % epoch_times[-1], "validation accuracy %.4f" % val_acc
+            else:
+                best_epoch = epoch
+                print "Epoch", epoch + 1, "/", max_epochs, "%.2fs" % epoch_times[-1]
+            if self.patience is not None and epoch - best_epoch >= self.patience:
+                print "Stopping: no improvement for", self.patience, "epochs"
+                break
+            if self.time_budget is not None and time.time() - start_time >= self.time_budget:
+                print "Stopping: time budget of", self.time_budget, "s spent"
+                break
+        refit_time = 0.
+        if len(val_rows) > 0 and best_epoch is not None:  # the validation instances are training data too
+            print "Training on all instances for", best_epoch + 1, "epochs"
+            refit_start = time.time()
+            run_epoch = epoch_runner(np.arange(len(y)))
+            for epoch in range(best_epoch + 1):
+                run_epoch(epoch)
+            refit_time = time.time() - refit_start
+        return {"best_epoch": best_epoch + 1 if best_epoch is not None else 0, "epochs": len(epoch_times),
+                "max_epochs": max_epochs, "validation_acc": best_acc,
+                "time_saved": float(np.median(epoch_times)) * (max_epochs - len(epoch_times)) - refit_time if epoch_times else 0.}
 
 
 # Generic classifier, doesn't do much
 class Classifier:
-    def __init__(self, lexicon, all_unknown=False, num_components=False, max_sampled=False, num_epochs=False ):
+    def __init__(self, lexicon, all_unknown=False, num_components=False, max_sampled=False, num_epochs=False, num_threads=None,
+                 controller=None):
         self.clf = None
+        self.num_threads = num_threads if num_threads is not None else NUM_THREADS
         self.lexicon = lexicon
         self.all_unknown = all_unknown
         self.num_components = num_components
         self.max_sampled = max_sampled
         self.num_epochs = num_epochs
+        self.controller = controller if controller is not None else TrainingController()
+        self.training = None  # TrainingController.run info of the iterative classifiers
 
     def train(self, X, y, lemmapos):
         raise NotImplementedError("Not implemented, use child classes")
     def predict(self, X, lemmapos):
         raise NotImplementedError("Not implemented, use child classes")
+    def score_batch(self, X):  # frame scores for a matrix of instances, shape (instances, frames)
+        raise NotImplementedError("Not implemented, use child classes")
+
+    def get_params(self):  # (JSON-serializable settings, {name: weight array}) of a trained model
+        raise NotImplementedError("Not implemented, use child classes")
+    def set_params(self, params, weights):
+        raise NotImplementedError("Not implemented, use child classes")
+
+    def save(self, folder, conf=None):
+        """ Save the trained model as an artifact folder: meta.json with the classifier, configuration, lexicon frame ids
+            and format version, and one .npy file per weight array. The folder is replaced as a whole """
+        params, weights = self.get_params()
+        meta = {"version": MODEL_FORMAT_VERSION, "classifier": self.__class__.__name__,
+                "config": str(conf) if conf is not None else None, "lexicon": self.lexicon.source,
+                "frames": [self.lexicon.get_frame(i) for i in range(len(self.lexicon.idToFrame))],
+                "all_unknown": self.all_unknown, "num_components": self.num_components,
+                "max_sampled": self.max_sampled, "num_epochs": self.num_epochs, "training": self.training,
+                "params": params, "weights": sorted(weights.keys())}
+        tmp_folder = folder + ".tmp%d" % os.getpid()
+        os.makedirs(tmp_folder)
+        for name in weights:
+            np.save(os.path.join(tmp_folder, name + ".npy"), weights[name])
+        with open(os.path.join(tmp_folder, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=1)
+        if os.path.exists(folder):
+            shutil.rmtree(folder)
+        os.rename(tmp_folder, folder)
+
+    def predict_batch(self, X, lemmapos_list):  # predict a whole matrix at once, child classes can do it faster
+        return np.array([self.predict(x, lemmapos) for x, lemmapos in zip(X, lemmapos_list)], dtype=np.int)
+
+    def score_candidates(self, X, candidates):  # score_batch with -inf for the frames that are not candidates
+        num_frames = candidates.shape[1]
+        scores = self.score_batch(X)
+        if scores.shape[1] < num_frames:  # the model may not know the highest frame ids
+            scores = np.hstack((scores, np.full((len(scores), num_frames - scores.shape[1]), -np.inf, dtype=scores.dtype)))
+        return np.where(candidates, scores[:, :num_frames], -np.inf)
+
+    def predict_topk(self, X, lemmapos_list, k):
+        """ The k best-scoring frames among the candidates of each instance, best first, shape (instances, k)
+            Candidates are chosen as in predict_best_available, rows with fewer than k candidates are padded with -1 """
+        lemmapos_ids = self.lexicon.get_lemmapos_ids(lemmapos_list)
+        candidates = self.lexicon.get_candidate_mask(lemmapos_ids, self.all_unknown)
+        scores = self.score_candidates(X, candidates)
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k < scores.shape[1] else np.tile(np.arange(k), (len(scores), 1))
+        rows = np.arange(len(scores))[:, None]
+        top = top[rows, np.argsort(-scores[rows, top], axis=1, kind="mergesort")]
+        top[np.isneginf(scores[rows, top])] = -1
+        return top
+
+    def predict_best_available(self, X, lemmapos_list):
+        """ Lexicon-constrained prediction for a whole matrix, scored by score_batch in one pass
+            Unknown lemma.pos (and all of them in the all_unknown setting) can take any frame,
+            known unambiguous ones get their only frame without scoring, ambiguous ones the best-scoring available frame """
+        predicted = np.empty(len(lemmapos_list), dtype=np.int)
+        lemmapos_ids = self.lexicon.get_lemmapos_ids(lemmapos_list)
+        candidates = self.lexicon.get_candidate_mask(lemmapos_ids, self.all_unknown)
+        num_frames = candidates.shape[1]
+        if not self.all_unknown:
+            # if the LU is known and has only one frame, just return it. Even if there is no data for this LU (!)
+            single = (lemmapos_ids >= 0) & ~self.lexicon.ambiguous[lemmapos_ids]
+            predicted[single] = self.lexicon.frame_ids[self.lexicon.offsets[lemmapos_ids[single]]]
+            candidates[single] = False
+        rows = np.flatnonzero(candidates.any(axis=1))
+        if len(rows) > 0:
+            scores = self.score_candidates(X[rows], candidates[rows])
+            best = scores.argmax(axis=1)
+            best_scores = scores[np.arange(len(rows)), best]
+            # np.argmax takes the first maximum, the sequential scan with >= took the last one among the candidates
+            for j in np.flatnonzero((scores == best_scores[:, None]).sum(axis=1) > 1):
+                if self.all_unknown or lemmapos_ids[rows[j]] < 0:
+                    candidate_list = self.lexicon.get_all_frame_ids()
+                else:
+                    candidate_list = self.lexicon.get_available_frame_ids(lemmapos_list[rows[j]])
+                for cl in candidate_list:
+                    if scores[j, cl] >= best_scores[j]:
+                        best[j] = cl
+            predicted[rows] = best
+        return predicted
 
 
 # Data-driven majority baseline
@@ -55,6 +211,12 @@ class DataMajorityBaseline(Classifier):
             return self.majorityClasses["__UNKNOWN__"]
         return self.majorityClasses.get(lemmapos, self.majorityClasses["__UNKNOWN__"])
 
+    def get_params(self):
+        return {"majority": {lemmapos: int(y) for lemmapos, y in self.majorityClasses.items()}}, {}
+
+    def set_params(self, params, weights):
+        self.majorityClasses = params["majority"]
+
 
 # Lexicon-driven majority baseline
 class LexiconMajorityBaseline(DataMajorityBaseline):
@@ -78,47 +240,86 @@ class LexiconMajorityBaseline(DataMajorityBaseline):
 
 
 # A simple NN-based classifier
+# Keras is only used for training: the weights of the Dense layers are then exported to NumPy arrays (layers)
+# and prediction is a NumPy forward pass, so saved models are loaded and applied without keras
 class SharingDNNClassifier(Classifier):
-    def train(self, X, y, lemmapos_list):
+    def build(self, input_dim, num_outputs):
+        from keras.models import Sequential
+        from keras.layers.core import Dense
         self.clf = Sequential()
-        self.clf.add(Dense(256, input_dim=len(X[0]), activation='relu'))
+        self.clf.add(Dense(256, input_dim=input_dim, activation='relu'))
         self.clf.add(Dense(100, activation='relu'))
-        self.clf.add(Dense(output_dim=np.max(y)+1, activation='softmax'))  # np.max()+1 because frames are 0-indexed
+        self.clf.add(Dense(output_dim=num_outputs, activation='softmax'))
 
         self.clf.compile(optimizer='adagrad',
                     loss='categorical_crossentropy',
                     metrics=['accuracy'])
 
-        self.clf.fit(X, to_categorical(y, np.max(y)+1), verbose=1, nb_epoch=100)
+    def train(self, X, y, lemmapos_list):
+        from keras.utils.np_utils import to_categorical
+        num_outputs = np.max(y)+1  # np.max()+1 because frames are 0-indexed
+
+        def epoch_runner(rows):
+            X_rows, Y_rows = X[rows], to_categorical(y[rows], num_outputs)
+
+            def run_epoch(epoch):
+                if epoch == 0:
+                    self.build(len(X[0]), num_outputs)
+                self.clf.fit(X_rows, Y_rows, verbose=0, epochs=1)
+                self.export()  # for the validation predictions
+            return run_epoch
+        self.training = self.controller.run(self, DNN_EPOCHS, epoch_runner, X, y, lemmapos_list)
+        self.clf = None  # the exported weights are the model now
+
+    def export(self):  # NumPy (kernel, bias) of each Dense layer of the keras model
+        weights = self.clf.get_weights()
+        self.layers = [(weights[i], weights[i + 1]) for i in range(0, len(weights), 2)]
 
     def predict(self, X, lemmapos):
-        available_frames = self.lexicon.get_available_frame_ids(lemmapos)  # get available frames from lexicon
-        ambig = self.lexicon.is_ambiguous(lemmapos)
-        unknown = self.lexicon.is_unknown(lemmapos)  # unknown = not in lexicon
+        return self.predict_batch(X.reshape((-1, len(X))), [lemmapos])[0]
 
-        if unknown or self.all_unknown:  # the all_unknown setting renders all lemma.pos unknown!
-            available_frames = self.lexicon.get_all_frame_ids()  # if the lemma.pos is unknown, search in all frames
-        else:
-            # if the LU is known and has only one frame, just return it. Even if there is no data for this LU (!)
-            if not ambig:
-                return available_frames[0]
+    def predict_batch(self, X, lemmapos_list):
+        return self.predict_best_available(X, lemmapos_list)
+
+    def hidden(self, X):  # output of the relu layers
+        h = np.asarray(X, dtype=np.float32)
+        for kernel, bias in self.layers[:-1]:
+            h = np.maximum(np.dot(h, kernel) + bias, 0)
+        return h
 
-        y = self.clf.predict(X.reshape((-1, len(X))))[0]
-        # pick the best-scoring frame among available
-        bestScore = None
-        bestClass = None
-        for cl in available_frames:
-            score = y[cl]
-            if bestScore is None or score >= bestScore:
-                bestScore = score
-                bestClass = cl
-        return bestClass
+    def score_batch(self, X):  # softmax over all frames, one forward pass for all instances
+        kernel, bias = self.layers[-1]
+        logits = np.dot(self.hidden(X), kernel) + bias
+        logits -= logits.max(axis=1)[:, None]
+        scores = np.exp(logits)
+        scores /= scores.sum(axis=1)[:, None]
+        return scores
+
+    def score_candidates(self, X, candidates):
+        """ Output logits of the frames that are candidates of some instance, -inf for the others
+            The softmax doesn't change the order of the frames of an instance, so it is skipped """
+        num_frames = candidates.shape[1]
+        kernel, bias = self.layers[-1]
+        scores = np.full((len(candidates), num_frames), -np.inf, dtype=np.float32)
+        columns = np.flatnonzero(candidates[:, :kernel.shape[1]].any(axis=0))  # the model may not know the highest frame ids
+        if len(columns) > 0:
+            scores[:, columns] = np.dot(self.hidden(X), kernel[:, columns]) + bias[columns]
+        return np.where(candidates, scores, -np.inf)
+
+    def get_params(self):
+        return {"input_dim": int(self.layers[0][0].shape[0]), "num_outputs": int(self.layers[-1][1].shape[0])}, \
+               {"layer%d" % i: w for i, w in enumerate(w for layer in self.layers for w in layer)}
+
+    def set_params(self, params, weights):  # memory-mapped weights, no keras model
+        self.layers = [(weights["layer%d" % i], weights["layer%d" % (i + 1)]) for i in range(0, len(weights), 2)]
+        self.clf = None
 
 
 # classification with WSABIE latent representations
 class WsabieClassifier(Classifier):
     def train(self, X, y, lemmapos_list):
-        
+        from lightfm import LightFM
+
         # MODEL
         self.clf = LightFM(no_components = self.num_components, learning_schedule = 'adagrad', loss = 'warp', \
                            learning_rate = 0.05, epsilon = 1e-06, item_alpha = 0.0, user_alpha = 1e-6, \
@@ -133,60 +334,85 @@ class WsabieClassifier(Classifier):
         #    the frame IDs are the labels for the representations
         #    --> these are used to create the interaction matrix for the training set such that LightFM can deal with it
         # y_interactionLabels: interaction matrix is of size (num sentences in y) x (num frames) with 1 indicating the frame label for a predicate in its context sentence
-        y_interactionLabels = self.createInteractionMatrix(y)
-                 
-        # FIT
-        self.clf = self.clf.fit(interactions = y_interactionLabels, user_features = X, item_features = None, \
-                                sample_weight = None, epochs = self.num_epochs, num_threads = 2, verbose = True)
+        def epoch_runner(rows):  # the instances to train on, chosen by the controller
+            y_interactionLabels = self.createInteractionMatrix(np.asarray(y)[rows])
+            # LightFM takes sparse user features, converted once here instead of in every call
+            user_features = sp.csr_matrix(X[rows], dtype=np.float32)
+
+            # FIT
+            # the first epoch (fit) resets the model, the others continue it (fit_partial), which is the same as
+            # fit with all epochs at once but lets the controller validate and stop after each epoch
+            def run_epoch(epoch):
+                fit = self.clf.fit if epoch == 0 else self.clf.fit_partial
+                self.clf = fit(interactions = y_interactionLabels, user_features = user_features, item_features = None, \
+                               sample_weight = None, epochs = 1, num_threads = self.num_threads, verbose = False)
+                self.normalize_items()  # for the validation predictions
+            return run_epoch
+        self.training = self.controller.run(self, self.num_epochs, epoch_runner, X, y, lemmapos_list)
+
+    def normalize_items(self):
+        # frame embeddings don't change after training: L2-normalize them once for the cosine similarity
+        norms = np.linalg.norm(self.clf.item_embeddings, axis=1)
+        self.item_embeddings_normalized = self.clf.item_embeddings / np.where(norms > 0, norms, 1)[:, None]
 
     def predict(self, X, lemmapos):
+        return self.predict_batch(X.reshape((-1, len(X))), [lemmapos])[0]
+
+    def predict_batch(self, X, lemmapos_list):
+        return self.predict_best_available(X, lemmapos_list)
+
+    def score_batch(self, X):
         # DATA
         # test data
-        # X: list of vectors
+        # X: matrix of vectors
         #    each vector is the initial representation for a sentence (more precisely, for a predicate with context)
         #    --> these are the user features in the test set
-        X_reshape = X.reshape((-1, len(X)))
 
-        # get projection matrices from trained MODEL
-        user_embeddings_fromTraining = self.clf.user_embeddings
-        item_embeddings_fromTraining = self.clf.item_embeddings
-        
         # PREDICT
-        # do the prediction for this new user via the dot product of the user feature X and the projection matrix user embeddings obtained during training
-        embeddedNewUser = np.dot(X_reshape, user_embeddings_fromTraining) # now in the same space as the item embeddings obtained during training
-        # use cosine similarity as similarity measure between the embedded test sentence and all the embeddings corresponding to frames
-        similarity_to_all_frames = cosine_similarity(embeddedNewUser, item_embeddings_fromTraining)[0]
-        
-        available_frame_IDs = self.lexicon.get_available_frame_ids(lemmapos)  # get available frame IDs for this lemma.pos from lexicon
-        ambig = self.lexicon.is_ambiguous(lemmapos)  # amiguous = can evoke more than one frame
-        unknown = self.lexicon.is_unknown(lemmapos)  # unknown = not in lexicon
-
-        if unknown or self.all_unknown:  # the all_unknown setting renders all lemma.pos unknown!
-            available_frame_IDs = self.lexicon.get_all_frame_ids()  # if the lemma.pos is unknown, search in all frames
-        else:
-            # if the lemma.pos is known and has only one frame, just return it. Even if there is no data for this lemma.pos.
-            if not ambig:
-                return available_frame_IDs[0]
-            
-        # pick the best-scoring frameID among available frameIDs
-        bestScore = None
-        best_frame_ID = None
-        for frame_ID in available_frame_IDs:
-            score = similarity_to_all_frames[frame_ID]
-            if bestScore is None or score >= bestScore:
-                bestScore = score
-                best_frame_ID = frame_ID
-        return best_frame_ID
-    
-    
+        # do the prediction for the new users via the dot product of the user features X and the projection matrix user embeddings obtained during training
+        embeddedNewUsers = np.dot(X, self.clf.user_embeddings) # now in the same space as the item embeddings obtained during training
+        # use cosine similarity as similarity measure between the embedded test sentences and all the embeddings corresponding to frames:
+        # normalize the embedded sentences, then a single product with the normalized frame embeddings
+        norms = np.linalg.norm(embeddedNewUsers, axis=1)
+        embeddedNewUsers /= np.where(norms > 0, norms, 1)[:, None]
+        return np.dot(embeddedNewUsers, self.item_embeddings_normalized.T)
+
+    def get_params(self):
+        return {}, {name: getattr(self.clf, name) for name in ["user_embeddings", "item_embeddings", "user_biases", "item_biases"]}
+
+    def set_params(self, params, weights):
+        from lightfm import LightFM
+        self.clf = LightFM(no_components = self.num_components, learning_schedule = 'adagrad', loss = 'warp', \
+                           max_sampled = self.max_sampled)
+        for name in weights:  # memory-mapped, scoring only reads them
+            setattr(self.clf, name, weights[name])
+        self.normalize_items()
+
     def createInteractionMatrix(self, y_ID):
         # interactionMatrix is of size (num sentences in y_ID) x (num frames) with 1 indicating the frame label for a predicate in its context sentence
-        
-        numSentInY = len(y_ID)
+        # sparse, one entry per sentence. Sentences with a frame unknown to the lexicon (id -1) get no entry
+        y_ID = np.asarray(y_ID)
         numFrames = len(self.lexicon.get_all_frame_ids())
-        y_interactionLabels = np.zeros([numSentInY, numFrames], dtype = np.float32)
-                
-        for i in range(numSentInY):
-            y_interactionLabels[i, y_ID[i]] = 1.
-        
-        return y_interactionLabels
\ No newline at end of file
+        labeled = np.flatnonzero(y_ID >= 0)
+        return sp.coo_matrix((np.ones(len(labeled), dtype = np.float32), (labeled, y_ID[labeled])),
+                             shape = (len(y_ID), numFrames))
+
+
+CLASSIFIERS = {c.__name__: c for c in [DataMajorityBaseline, LexiconMajorityBaseline, SharingDNNClassifier, WsabieClassifier]}
+
+
+def load_classifier(folder, lexicon):
+    """ Load a model saved with Classifier.save, the weight arrays are memory-mapped
+        The lexicon must assign the same frame ids as the lexicon the model was trained with """
+    with open(os.path.join(folder, "meta.json")) as f:
+        meta = json.load(f)
+    if meta["version"] != MODEL_FORMAT_VERSION:
+        raise ValueError("Model format version %s, expected %s: %s" % (meta["version"], MODEL_FORMAT_VERSION, folder))
+    if meta["frames"] != [lexicon.get_frame(i) for i in range(len(lexicon.idToFrame))]:
+        raise ValueError("Frame ids of the lexicon " + lexicon.source + " don't match the model: " + folder)
+    clf = CLASSIFIERS[meta["classifier"]](lexicon, meta["all_unknown"], meta["num_components"], meta["max_sampled"],
+                                          meta["num_epochs"])
+    weights = {name: np.load(os.path.join(folder, name + ".npy"), mmap_mode="r") for name in meta["weights"]}
+    clf.set_params(meta["params"], weights)
+    clf.training = meta.get("training")
+    return clf
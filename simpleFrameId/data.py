@@ -1,8 +1,26 @@
-import codecs, sys
-from graph import DependencyGraph
+import codecs, sys, os
+import hashlib
+import numpy as np
+from array import array
+from graph import Sentence, DependencyGraph, StringTable
 
 # Data management routines
 
+CORPUS_FORMAT_VERSION = 1  # increase when the compiled corpus layout or the graph construction changes
+
+digests = {}  # (path, size, mtime) -> content digest, so each file is hashed once per process
+
+
+def file_digest(path):
+    key = (path, os.path.getsize(path), os.path.getmtime(path))
+    if key not in digests:
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        digests[key] = h.hexdigest()
+    return digests[key]
+
 
 def fix_tid(src_tid, sep):  # fixes and unrolls the offsets
     if sep not in src_tid:
@@ -21,87 +39,289 @@ def fix_tid(src_tid, sep):  # fixes and unrolls the offsets
         return tuple(set(sorted([int(i) for i in unrolled_span])))
 
 
+def parse_srl_line(line):  # one line of SRL data -> (sentence_id, fee_tid, [fee_frame, fee_lemmapos, {role: role_span}])
+    line = line.strip().split("\t")
+    fee_tid = fix_tid(line[5], "_")  # predicate offsets are given as tid_tid_tid_tid
+    fee_frame = line[3]
+    fee_lemmapos = line[4].lower()
+    sid = int(line[7])
+    role_info = line[8:]
+    fee_info = []  # ugly but so is the data! Multiple fee possible on single span
+    fee_info += [fee_frame]
+    fee_info += [fee_lemmapos]
+
+    role_dict = {}
+    for x in range(0, len(role_info), 2):
+        role_dict[role_info[0]] = fix_tid(role_info[1], ":")  # role offsets are given as start:end
+    fee_info += [role_dict]
+    return sid, fee_tid, fee_info
+
+
+def add_srl_info(srl, fee_tid, fee_info):  # srl: {fe_id: [[fee_frame, fee_lemmapos, {role: role_span}], ...]} of one sentence
+    srl[fee_tid] = srl.get(fee_tid, [])
+    srl[fee_tid] += [fee_info]
+
+
 def collect_srl_data(in_fes):  # load SRL data (~frame.elements). All the offsets are shifted by 1!
     srl_data = {}  # {sentence_id: {fe_id: [[fee_frame, fee_lemmapos, {role: role_span}], [fee_frame2, {role: role_span}], ...]}
     for line in in_fes:
-        line = line.strip().split("\t")
-        fee_tid = fix_tid(line[5], "_")  # predicate offsets are given as tid_tid_tid_tid
-        fee_frame = line[3]
-        fee_lemmapos = line[4].lower()
-        sid = int(line[7])
-        role_info = line[8:]
+        sid, fee_tid, fee_info = parse_srl_line(line)
         srl_data[sid] = srl_data.get(sid, {})
-        srl_data[sid][fee_tid] = srl_data[sid].get(fee_tid, [])
-        fee_info = []  # ugly but so is the data! Multiple fee possible on single span
-        fee_info += [fee_frame]
-        fee_info += [fee_lemmapos]
-
-        role_dict = {}
-        for x in range(0, len(role_info), 2):
-            role_dict[role_info[0]] = fix_tid(role_info[1], ":")  # role offsets are given as start:end
-        fee_info += [role_dict]
-        srl_data[sid][fee_tid] += [fee_info]
+        add_srl_info(srl_data[sid], fee_tid, fee_info)
     return srl_data
 
 
-def collect_sentence_data(in_sentences):  # load parse data (~all.lemma.tags)
+def parse_sentence_line(line, sid):  # one non-empty line of parse data -> {tid: {form, pos, dep, head, lemma}}
+    line = line.split("\t")
+    num_tok = int(line[0])
+    line = line[1:]
+    data = [line[x*num_tok:x*num_tok+num_tok] for x in range(0, len(line)/num_tok)]  # TODO list comprehension ninja required here
+    sentence = {}
+    try:
+        tid = 1
+        for form, pos, dep, head, _, lemma in zip(*data):
+            sentence[tid] = {}
+            sentence[tid]["form"] = form
+            sentence[tid]["pos"] = pos
+            sentence[tid]["dep"] = dep
+            sentence[tid]["head"] = int(head)
+            sentence[tid]["lemma"] = lemma
+            tid += 1
+    except Exception:
+        print "Malformed parse data in sentence", sid
+        sentence = None
+    return sentence
+
+
+def read_sentences(in_sentences):  # (sentence_id, sentence) pairs in file order, empty lines are skipped
     sid = 0
-    sentences = {}
     for line in in_sentences:
         line = line.strip()
         if line:
-            line = line.split("\t")
-            num_tok = int(line[0])
-            line = line[1:]
-            data = [line[x*num_tok:x*num_tok+num_tok] for x in range(0, len(line)/num_tok)]  # TODO list comprehension ninja required here
-            sentences[sid] = {}
-            try:
-                tid = 1
-                for form, pos, dep, head, _, lemma in zip(*data):
-                    sentences[sid][tid] = {}
-                    sentences[sid][tid]["form"] = form
-                    sentences[sid][tid]["pos"] = pos
-                    sentences[sid][tid]["dep"] = dep
-                    sentences[sid][tid]["head"] = int(head)
-                    sentences[sid][tid]["lemma"] = lemma
-                    tid += 1
-            except Exception:
-                print "Malformed parse data in sentence", sid
-                sentences[sid] = None
-            finally:
-                sid += 1
+            yield sid, parse_sentence_line(line, sid)
+            sid += 1
+
+
+def scan_vocabulary(src_sentences_list):
+    """ Lowercased words of the sentence files: everything the mappers can look up in a VSM for these corpora
+        (sentence words, dependents, parents and the ROOT node), utf-8 encoded like the VSM vocabulary """
+    vocabulary = set(["root"])
+    for src_sentences in src_sentences_list:
+        with codecs.open(src_sentences, "r", "utf-8") as in_sentences:
+            for sid, sentence in read_sentences(in_sentences):
+                if sentence is not None:
+                    for token in sentence.values():
+                        form = token["form"].lower().encode("utf-8")
+                        vocabulary.add(form)
+                        vocabulary.update(form.split(" "))  # SentenceBowMapper splits the sentence at spaces
+    return vocabulary
+
+
+def collect_sentence_data(in_sentences):  # load parse data (~all.lemma.tags)
+    sentences = {}
+    for sid, sentence in read_sentences(in_sentences):
+        sentences[sid] = sentence
     return sentences
 
 
+def sentence_to_graphs(sid, sentence, srl, verbose=False, strings=None):  # one graph per predicate of the sentence
+    if sentence is not None:
+        nodes = {tid: sentence[tid]["form"] for tid in sentence}
+        edges = [(sentence[tid]["head"], tid, sentence[tid]["dep"]) for tid in sentence]
+        parsed = None  # built once and shared by the graphs of all predicates
+        for pred_tid in srl:
+            for pred_info in srl[pred_tid]:
+                if parsed is None:
+                    parsed = Sentence(nodes, edges, strings)
+                g = DependencyGraph(parsed)
+                frame, lemmapos, roles = pred_info
+                roles_by_tid = {}
+                for (x, y) in roles.items():
+                    for role_tid in y:
+                        roles_by_tid[int(role_tid)] = x
+                try:
+                    g.add_srl((pred_tid, frame, lemmapos), roles_by_tid)
+                    yield g
+                except Exception:
+                    print "SRL data error in sentence", sid, sys.exc_info()[0]
+                    if verbose:
+                        print "pred:", pred_tid, frame, lemmapos
+                        print roles_by_tid
+                        print g.pretty()
+
+
 def merge_to_graph(srl_data, sentences, verbose=False):  # zip sentence and SRL data together and turn them into a graph
+    strings = StringTable()  # words and labels of the corpus, freed with its graphs
     for sid in sentences:
         if sid in srl_data:
-            sentence = sentences[sid]
-            if sentence is not None:
-                nodes = {tid: sentence[tid]["form"] for tid in sentence}
-                edges = [(sentence[tid]["head"], tid, sentence[tid]["dep"]) for tid in sentence]
-                srl = srl_data[sid]
-                for pred_tid in srl:
-                    for pred_info in srl[pred_tid]:
-                        g = DependencyGraph(nodes, edges)
-                        frame, lemmapos, roles = pred_info
-                        roles_by_tid = {}
-                        for (x, y) in roles.items():
-                            for role_tid in y:
-                                roles_by_tid[int(role_tid)] = x
-                        try:
-                            g.add_srl((pred_tid, frame, lemmapos), roles_by_tid)
-                            yield g
-                        except Exception:
-                            print "SRL data error in sentence", sid, sys.exc_info()[0]
-                            if verbose:
-                                print "pred:", pred_tid, frame, lemmapos
-                                print roles_by_tid
-                                print g.pretty()
+            for g in sentence_to_graphs(sid, sentences[sid], srl_data[sid], verbose, strings):
+                yield g
+
+
+def stream_graphs(src_sentences, src_fes, verbose=False):
+    """ Streaming version of get_graphs: co-iterates both files by sentence id and yields graphs as soon as they are complete
+        SRL data is expected sorted by sentence id. Lines referring to an already passed sentence are buffered
+        and their graphs are built in a second pass over the sentence file, at the end """
+    gid = 0
+    num_labeled = 0
+    num_parsed = 0
+    late = {}  # {sentence_id: srl} for out-of-order SRL data
+    strings = StringTable()
+    with codecs.open(src_sentences, "r", "utf-8") as in_sentences:
+        with codecs.open(src_fes, "r", "utf-8") as in_fes:
+            srl_lines = (parse_srl_line(line) for line in in_fes)
+            lookahead = next(srl_lines, None)
+            for sid, sentence in read_sentences(in_sentences):
+                num_parsed += 1
+                srl = {}
+                while lookahead is not None and lookahead[0] <= sid:  # collect SRL data up to the current sentence
+                    fes_sid, fee_tid, fee_info = lookahead
+                    if fes_sid == sid:
+                        add_srl_info(srl, fee_tid, fee_info)
+                    else:
+                        late[fes_sid] = late.get(fes_sid, {})
+                        add_srl_info(late[fes_sid], fee_tid, fee_info)
+                    lookahead = next(srl_lines, None)
+                if len(srl) > 0:
+                    num_labeled += 1
+                for g in sentence_to_graphs(sid, sentence, srl, verbose, strings):
+                    g.gid = gid
+                    gid += 1
+                    yield g
+    if len(late) > 0:
+        print "Out-of-order SRL data for", len(late), "sentences, rereading", src_sentences.split("/")[-1]
+        with codecs.open(src_sentences, "r", "utf-8") as in_sentences:
+            for sid, sentence in read_sentences(in_sentences):
+                if sid in late:
+                    for g in sentence_to_graphs(sid, sentence, late[sid], verbose, strings):
+                        g.gid = gid
+                        gid += 1
+                        yield g
+    print src_sentences.split("/")[-1], src_fes.split("/")[-1], "labeled:", num_labeled, "out-of-order:", len(late), \
+        "parsed:", num_parsed, "graphs:", gid
+
+
+# Compiled corpora: the graphs of a corpus as flat arrays in one .npz file, loaded without re-parsing.
+# Strings are stored once in a table, tokens as indices into it (-1 = none). Sentences shared by several
+# graphs are stored once. The sizes, mtimes and digests of the source files are kept to detect stale files.
+def save_graphs(graphs, dst, src_paths):
+    strings = {}
+
+    def string_id(s):
+        if s is None:
+            return -1
+        if s not in strings:
+            strings[s] = len(strings)
+        return strings[s]
+
+    sentences = {}  # id(Sentence) -> index of the stored sentence
+    tok_offsets, tok_words, tok_heads, tok_labels = array("i", [0]), array("i"), array("i"), array("i")
+    graph_sentence, frames, lemmapos, gids = array("i"), array("i"), array("i"), array("i")
+    pred_offsets, pred_nodes = array("i", [0]), array("i")
+    role_offsets, role_heads, role_names = array("i", [0]), array("i"), array("i")
+    for g in graphs:
+        sentence = g.sentence
+        if id(sentence) not in sentences:
+            sentences[id(sentence)] = len(tok_offsets) - 1
+            for w, h, l in zip(sentence.words, sentence.heads, sentence.labels):
+                tok_words.append(string_id(sentence.strings.get_string(w) if w >= 0 else None))
+                tok_heads.append(h)
+                tok_labels.append(string_id(sentence.strings.get_string(l) if l >= 0 else None))
+            tok_offsets.append(len(tok_words))
+        graph_sentence.append(sentences[id(sentence)])
+        frames.append(string_id(g.frame))
+        lemmapos.append(string_id(g.lemmapos))
+        gids.append(g.gid)
+        pred_nodes.extend(g.predicate_nodes)
+        pred_offsets.append(len(pred_nodes))
+        for head in g.roles:
+            role_heads.append(head)
+            role_names.append(string_id(g.role_labels[head]))
+        role_offsets.append(len(role_heads))
+
+    table = sorted(strings, key=strings.get)
+    folder = os.path.dirname(dst)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    tmp = dst + ".%d.tmp" % os.getpid()  # written aside and renamed, readers never see a partial file
+    with open(tmp, "wb") as f:
+        np.savez(f, version=np.array(CORPUS_FORMAT_VERSION),
+                 strings=np.array(table, dtype=np.unicode_) if table else np.zeros(0, dtype="U1"),
+                 tok_offsets=np.array(tok_offsets), tok_words=np.array(tok_words),
+                 tok_heads=np.array(tok_heads), tok_labels=np.array(tok_labels),
+                 graph_sentence=np.array(graph_sentence), frames=np.array(frames),
+                 lemmapos=np.array(lemmapos), gids=np.array(gids),
+                 pred_offsets=np.array(pred_offsets), pred_nodes=np.array(pred_nodes),
+                 role_offsets=np.array(role_offsets), role_heads=np.array(role_heads),
+                 role_names=np.array(role_names),
+                 src_sizes=np.array([os.path.getsize(p) for p in src_paths], dtype=np.int64),
+                 src_mtimes=np.array([os.path.getmtime(p) for p in src_paths], dtype=np.float64),
+                 src_digests=np.array([file_digest(p) for p in src_paths]))
+    os.rename(tmp, dst)
+
+
+def is_compiled_current(path, src_paths):
+    """ A compiled corpus is current if it has the current format and its sources have not changed:
+        same size and mtime, or, if only the mtime differs (e.g. after a copy), the same content digest """
+    if not os.path.exists(path):
+        return False
+    try:
+        with np.load(path) as data:
+            if int(data["version"]) != CORPUS_FORMAT_VERSION or len(data["src_sizes"]) != len(src_paths):
+                return False
+            for p, size, mtime, digest in zip(src_paths, data["src_sizes"], data["src_mtimes"], data["src_digests"]):
+                if os.path.getsize(p) != size:
+                    return False
+                if os.path.getmtime(p) != mtime and file_digest(p) != digest:
+                    return False
+    except Exception:  # unreadable or truncated file, rebuild it
+        return False
+    return True
+
+
+def load_graphs(path):  # compiled corpus in, graphs out
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in data.files}
+    strings = [unicode(s) for s in arrays["strings"]]
+    table = StringTable()  # the file string ids are the ids of the table
+    for s in strings:
+        table.get_id(s)
+    tok_offsets = arrays["tok_offsets"].tolist()
+    tok_words, tok_heads, tok_labels = arrays["tok_words"].tolist(), arrays["tok_heads"].tolist(), arrays["tok_labels"].tolist()
+
+    sentences = []
+    for start, end in zip(tok_offsets[:-1], tok_offsets[1:]):
+        words = array("i", tok_words[start:end])
+        labels = array("i", tok_labels[start:end])
+        sent = " ".join(strings[w] for w in tok_words[start + 1:end] if w >= 0)
+        sentences += [Sentence.from_arrays(words, array("i", tok_heads[start:end]), labels, sent, table)]
+
+    pred_offsets, pred_nodes = arrays["pred_offsets"].tolist(), arrays["pred_nodes"].tolist()
+    role_offsets, role_heads, role_names = arrays["role_offsets"].tolist(), arrays["role_heads"].tolist(), arrays["role_names"].tolist()
+    graphs = []
+    for i, (s, frame, lemmapos, gid) in enumerate(zip(arrays["graph_sentence"].tolist(), arrays["frames"].tolist(),
+                                                      arrays["lemmapos"].tolist(), arrays["gids"].tolist())):
+        g = DependencyGraph(sentences[s])
+        roles = [(head, strings[name]) for head, name in zip(role_heads[role_offsets[i]:role_offsets[i + 1]],
+                                                             role_names[role_offsets[i]:role_offsets[i + 1]])]
+        g.set_srl(pred_nodes[pred_offsets[i]:pred_offsets[i + 1]], strings[frame], strings[lemmapos], roles)
+        g.gid = gid
+        graphs += [g]
+    print path.split("/")[-1], "sentences:", len(sentences), "graphs:", len(graphs)
+    return graphs
 
 
 # This is the method you are looking for
-def get_graphs(src_sentences, src_fes, verbose=False):  # files in, graphs out
+def get_graphs(src_sentences, src_fes, verbose=False, stream=False, compiled=None):  # files in, graphs out
+    """ compiled: path of a compiled corpus, loaded if it is current, otherwise written after parsing """
+    if stream:  # generator with flat memory usage instead of a list
+        return stream_graphs(src_sentences, src_fes, verbose)
+    if compiled is not None:
+        if is_compiled_current(compiled, [src_sentences, src_fes]):
+            return load_graphs(compiled)
+        graphs = get_graphs(src_sentences, src_fes, verbose)
+        save_graphs(graphs, compiled, [src_sentences, src_fes])
+        return graphs
     i = 0
     with codecs.open(src_sentences, "r", "utf-8") as in_sentences:
         with codecs.open(src_fes, "r", "utf-8") as in_fes:
@@ -113,5 +333,3 @@ def get_graphs(src_sentences, src_fes, verbose=False):  # files in, graphs out
                 graph.gid = i
                 i += 1
             return graphs
-
-
@@ -1,3 +1,6 @@
+import numpy as np
+from scipy.sparse import coo_matrix
+
 # Evaluation routines
 
 
@@ -36,6 +39,21 @@ class Score:
             self.total_unknown += int(unknown)
             self.correct_unknown += int(unknown & correct)
 
+    def consume_batch(self, correct, ambig, unknown, gold_frame):  # consume for arrays of instances at once
+        keep = gold_frame != -1 if self.skip_unknown_frames else np.ones(len(gold_frame), dtype=np.bool)
+        correct, ambig, unknown = correct[keep], ambig[keep], unknown[keep]
+        self.total += int(keep.sum())
+        self.correct += int(correct.sum())
+
+        self.total_ambig += int(ambig.sum())
+        self.correct_ambig += int((ambig & correct).sum())
+
+        self.total_unambig += int((~ambig).sum())
+        self.correct_unambig += int((correct & ~ambig).sum())
+
+        self.total_unknown += int(unknown.sum())
+        self.correct_unknown += int((unknown & correct).sum())
+
     def report_accuracies(self):
         print "Acc", acc(self.correct, self.total)
         print "Ambig", acc(self.correct_ambig, self.total_ambig)
@@ -58,3 +76,34 @@ class Score:
         self.report_counts()
         print "=========================="
 
+
+class EvaluationResult:
+    """ Predictions for a whole test set with the per-instance information needed for scoring, as arrays.
+        Slices (verbs, known lemmas, a frame...) are boolean masks over these arrays """
+    def __init__(self, predicted, gold, lemmapos_list, lexicon):
+        self.predicted = np.asarray(predicted)
+        self.gold = np.asarray(gold)
+        self.correct = self.predicted == self.gold
+        lemmapos_ids = lexicon.get_lemmapos_ids(lemmapos_list)
+        self.unknown = lemmapos_ids < 0
+        self.ambig = lexicon.ambiguous[lemmapos_ids] & ~self.unknown if len(lexicon.ambiguous) > 0 else np.zeros(len(self.gold), dtype=np.bool)
+        self.pos = np.array([lemmapos.rpartition(".")[2] if "." in lemmapos else "" for lemmapos in lemmapos_list])
+
+    def score(self, mask=None, skip_unknown_frames=True):  # Score of the instances selected by mask, all by default
+        score = Score(skip_unknown_frames)
+        if mask is None:
+            score.consume_batch(self.correct, self.ambig, self.unknown, self.gold)
+        else:
+            score.consume_batch(self.correct[mask], self.ambig[mask], self.unknown[mask], self.gold[mask])
+        return score
+
+    def frame_counts(self, num_frames, mask=None):  # (instances, correct predictions) per gold frame id
+        gold, correct = (self.gold, self.correct) if mask is None else (self.gold[mask], self.correct[mask])
+        known = gold >= 0
+        return np.bincount(gold[known], minlength=num_frames), np.bincount(gold[known], correct[known], minlength=num_frames).astype(np.int64)
+
+    def confusion(self, num_frames, mask=None):  # sparse (gold frame x predicted frame) counts
+        gold, predicted = (self.gold, self.predicted) if mask is None else (self.gold[mask], self.predicted[mask])
+        known = (gold >= 0) & (predicted >= 0)
+        return coo_matrix((np.ones(known.sum(), dtype=np.int64), (gold[known], predicted[known])),
+                          shape=(num_frames, num_frames)).tocsr()  # duplicates are summed
@@ -1,5 +1,7 @@
 import numpy as np
 import codecs
+import os
+from scipy.sparse import csr_matrix
 
 # Extra classes for managing external resources
 
@@ -10,17 +12,27 @@ class Lexicon:  # Lexicon manager. Stores information about lemma.pos -> frame m
         self.frameToId = {}
         self.idToFrame = {}
         self.source = "NA"
+        self.path = None  # source file, None if the lexicon was not loaded from a list
+        # compiled index, see compile_index
+        self.lemmaposToId = {}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.frame_ids = np.zeros(0, dtype=np.int32)
+        self.ambiguous = np.zeros(0, dtype=np.bool)
+        self.all_frame_ids = []
 
     def get_id(self, frame):
         if frame not in self.frameToId:
             print "Unknown frame", frame, "assigning id=-1"
         return self.frameToId.get(frame, -1)
 
-    def get_available_frame_ids(self, lemmapos):
-        return [self.frameToId[x] for x in self.frameLexicon.get(lemmapos, [])]
+    def get_available_frame_ids(self, lemmapos):  # a view into the compiled index, in lexicon order
+        i = self.lemmaposToId.get(lemmapos)
+        if i is None:
+            return self.frame_ids[:0]
+        return self.frame_ids[self.offsets[i]:self.offsets[i+1]]
 
     def get_all_frame_ids(self):
-        return list(self.idToFrame.keys())
+        return self.all_frame_ids
 
     def get_frame(self, id):
         return self.idToFrame.get(id, "UNKNOWN_FRAME")
@@ -37,12 +49,56 @@ class Lexicon:  # Lexicon manager. Stores information about lemma.pos -> frame m
         self.frameToId = {frames[i]:i for i in range(len(frames))}
         self.idToFrame = {y:x for (x,y) in self.frameToId.items()}
         self.source = src.split("/")[-1]
+        self.path = src
+        self.compile_index()
 
     def is_unknown(self, lemmapos):
-        return lemmapos not in self.frameLexicon
+        return lemmapos not in self.lemmaposToId
 
     def is_ambiguous(self, lemmapos):
-        return len(self.frameLexicon.get(lemmapos, []))>1
+        i = self.lemmaposToId.get(lemmapos)
+        return i is not None and bool(self.ambiguous[i])
+
+    def compile_index(self):
+        """ Compile frameLexicon into a CSR-style index, must be called after loading
+            Frames of the lemma.pos with id i are frame_ids[offsets[i]:offsets[i+1]], ambiguous[i] is set if there is more than one """
+        self.lemmaposToId = {}
+        self.offsets = np.zeros(len(self.frameLexicon)+1, dtype=np.int64)
+        frame_ids = []
+        for i, lemmapos in enumerate(self.frameLexicon):
+            self.lemmaposToId[lemmapos] = i
+            frame_ids += [self.frameToId[x] for x in self.frameLexicon[lemmapos]]
+            self.offsets[i+1] = len(frame_ids)
+        self.frame_ids = np.array(frame_ids, dtype=np.int32)
+        self.ambiguous = np.diff(self.offsets) > 1
+        self.all_frame_ids = list(self.idToFrame.keys())
+
+    def get_lemmapos_ids(self, lemmapos_list):  # lemma.pos ids for a list of instances, -1 for unknown ones
+        return np.array([self.lemmaposToId.get(x, -1) for x in lemmapos_list], dtype=np.int64)
+
+    def get_candidate_mask(self, lemmapos_ids, all_unknown=False, sparse=False):
+        """ Boolean (instances x frames) mask of the frames available for each instance, given its lemma.pos id
+            Unknown lemma.pos (and all of them in the all_unknown setting) can take any frame.
+            Returns a dense array or, with sparse=True, a scipy CSR matrix """
+        num_frames = len(self.idToFrame)
+        known = lemmapos_ids >= 0
+        if all_unknown:
+            known[:] = False
+        known_ids = lemmapos_ids[known]
+        starts = np.zeros(len(lemmapos_ids), dtype=np.int64)
+        starts[known] = self.offsets[known_ids]
+        lengths = np.full(len(lemmapos_ids), num_frames, dtype=np.int64)
+        lengths[known] = self.offsets[known_ids+1] - self.offsets[known_ids]
+        indptr = np.concatenate(([0], np.cumsum(lengths)))
+        within = np.arange(indptr[-1]) - np.repeat(indptr[:-1], lengths)  # position inside the row
+        indices = within.copy()  # unknown: all frames
+        from_index = np.repeat(known, lengths)
+        indices[from_index] = self.frame_ids[np.repeat(starts, lengths)[from_index] + within[from_index]]
+        if sparse:
+            return csr_matrix((np.ones(len(indices), dtype=np.bool), indices, indptr), shape=(len(lemmapos_ids), num_frames))
+        mask = np.zeros((len(lemmapos_ids), num_frames), dtype=np.bool)
+        mask[np.repeat(np.arange(len(lemmapos_ids)), lengths), indices] = True
+        return mask
 
     # Load from training data
     def load_from_graphs(self, g_train):
@@ -57,29 +113,172 @@ class Lexicon:  # Lexicon manager. Stores information about lemma.pos -> frame m
         self.frameToId = {frames[i]: i for i in range(len(frames))}
         self.idToFrame = {y: x for (x, y) in self.frameToId.items()}
         self.source = "training_data"
+        self.compile_index()
+
+
+# Binary VSM format: a contiguous float32 matrix (src.npy) and the words of its rows, one per line (src.vocab).
+# The text VSM is converted once, afterwards the matrix is memory-mapped, so loading is cheap and concurrent
+# processes share the same page cache.
+# Quantized copies store the matrix as float16 or as int8 with one float32 scale per row (src.scale.npy),
+# rows are converted back to float32 when they are read (VSM.get_rows).
+VSM_PRECISIONS = ["float32", "float16", "int8"]
+
+
+def split_vsm_name(vsm_name):  # "name:precision" -> (name, precision), float32 without suffix
+    name, _, precision = vsm_name.partition(":")
+    precision = precision if precision else "float32"
+    if precision not in VSM_PRECISIONS:
+        raise ValueError("Unknown VSM precision " + precision + " in " + vsm_name + ", use one of " + ", ".join(VSM_PRECISIONS))
+    return name, precision
+
+
+def get_compiled_vsm(src):
+    return src + ".npy", src + ".vocab"
+
+
+def get_vsm_scale(src):  # per-row scales of an int8 VSM
+    return src + ".scale.npy"
+
+
+def is_compiled_vsm(src, scaled=False):  # compiled files (and the scales of an int8 VSM) exist and are not older than the text VSM
+    matrix_path, vocab_path = get_compiled_vsm(src)
+    if not (os.path.exists(matrix_path) and os.path.exists(vocab_path)):
+        return False
+    if scaled and not os.path.exists(get_vsm_scale(src)):
+        return False
+    if not os.path.exists(src):
+        return True
+    return min(os.path.getmtime(matrix_path), os.path.getmtime(vocab_path)) >= os.path.getmtime(src)
+
+
+def get_tmp_path(path):  # written by this process only, renamed to path when complete
+    return path + ".%d.tmp" % os.getpid()
+
+
+def compile_vsm(src):  # text VSM [word dim1 dim2 ...] -> binary VSM
+    matrix_path, vocab_path = get_compiled_vsm(src)
+    num_words = 0
+    dim = None
+    with open(src) as f:  # first pass: get the matrix shape
+        for line in f:
+            if dim is None:
+                dim = len(line.split()) - 1
+            num_words += 1
+    # worker processes may compile the same VSM at the same time: each writes its own files, and since the
+    # contents are the same, it doesn't matter whose rename comes last
+    matrix = np.lib.format.open_memmap(get_tmp_path(matrix_path), mode="w+", dtype=np.float32, shape=(num_words, dim))
+    with open(src) as f, open(get_tmp_path(vocab_path), "w") as vocab:
+        for i, line in enumerate(f):  # second pass: write rows directly to disk
+            line = line.split()
+            matrix[i] = np.array(line[1:], dtype=np.float32)
+            vocab.write(line[0] + "\n")
+    matrix.flush()
+    del matrix
+    os.rename(get_tmp_path(matrix_path), matrix_path)
+    os.rename(get_tmp_path(vocab_path), vocab_path)  # last: is_compiled_vsm needs both files
+    print "Compiled VSM", src.split("/")[-1], ":", num_words, "words,", dim, "dim"
+
+
+def prune_vsm(src, vocabulary, dst):  # binary VSM of src restricted to the words in vocabulary, written at dst
+    vsm = VSM(src)
+    rows = sorted(i for word, i in vsm.vocab.items() if word in vocabulary)
+    words = [None] * len(vsm.vocab)
+    for word, i in vsm.vocab.items():
+        words[i] = word
+    matrix_path, vocab_path = get_compiled_vsm(dst)
+    folder = os.path.dirname(dst)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(get_tmp_path(matrix_path), "wb") as f:  # workers may prune at the same time, see compile_vsm
+        np.save(f, vsm.matrix[rows])  # gathers only the needed rows from the memory-mapped matrix
+    with open(get_tmp_path(vocab_path), "w") as vocab:
+        for i in rows:
+            vocab.write(words[i] + "\n")
+    os.rename(get_tmp_path(matrix_path), matrix_path)
+    os.rename(get_tmp_path(vocab_path), vocab_path)
+    print "Pruned VSM", src.split("/")[-1], ":", len(rows), "of", len(vsm.vocab), "words"
+
+
+def quantize_vsm(vsm, precision, dst, chunk_size=65536):  # binary copy of a loaded VSM at the given precision
+    matrix_path, vocab_path = get_compiled_vsm(dst)
+    folder = os.path.dirname(dst)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    num_words = vsm.matrix.shape[0]
+    # workers may quantize at the same time, see compile_vsm
+    matrix = np.lib.format.open_memmap(get_tmp_path(matrix_path), mode="w+", dtype=np.dtype(precision), shape=vsm.matrix.shape)
+    scale = np.ones(num_words, dtype=np.float32)
+    for start in range(0, num_words, chunk_size):
+        rows = vsm.get_rows(np.arange(start, min(start + chunk_size, num_words)))
+        if precision == "int8":  # symmetric per-row scaling to [-127, 127]
+            row_scale = np.abs(rows).max(axis=1) / 127.
+            row_scale[row_scale == 0] = 1.
+            scale[start:start + len(rows)] = row_scale
+            rows = np.round(rows / row_scale[:, None])
+        matrix[start:start + len(rows)] = rows
+    matrix.flush()
+    del matrix
+    if precision == "int8":
+        with open(get_tmp_path(get_vsm_scale(dst)), "wb") as f:
+            np.save(f, scale)
+    words = [None] * num_words
+    for word, i in vsm.vocab.items():
+        words[i] = word
+    with open(get_tmp_path(vocab_path), "w") as vocab:
+        for word in words:
+            vocab.write((word if word is not None else "") + "\n")  # rows shadowed by a duplicate word keep their place
+    os.rename(get_tmp_path(matrix_path), matrix_path)
+    os.rename(get_tmp_path(vocab_path), vocab_path)
+    if precision == "int8":  # last: is_compiled_vsm(dst, scaled=True) accepts the VSM only when the scales are in place
+        os.rename(get_tmp_path(get_vsm_scale(dst)), get_vsm_scale(dst))
+    print "Quantized VSM", vsm.source, "to", precision, ": %.1f -> %.1f MB" % (
+        vsm.matrix.nbytes / 1024.**2, (os.path.getsize(matrix_path) + scale.nbytes * (precision == "int8")) / 1024.**2)
 
 
 class VSM:
-    def __init__(self, src):
-        self.map = {}
+    def __init__(self, src, compiled=None):
+        """ src: text VSM, converted to the binary format on first use
+            compiled: load the binary VSM at this path instead, e.g. a pruned or quantized copy of src
+                      (see prune_vsm, quantize_vsm) """
+        self.vocab = {}  # word -> row in the matrix
+        self.matrix = None
+        self.scale = None  # per-row scale of an int8 matrix
         self.dim = None
         self.source = src.split("/")[-1] if src is not None else "NA"
-        # create dictionary for mapping from word to its embedding
+        self.path = src
+        self.variant = None  # set for a derived VSM (pruned, quantized), whose features can differ from those of src
         if src is not None:
-            with open(src) as f:
-                i = 0
-                for line in f:
-                    word = line.split()[0]
-                    embedding = line.split()[1:]
-                    self.map[word] = np.array(embedding, dtype=np.float32)
-                    i += 1
-                self.dim = len(embedding)
+            if compiled is None:
+                if not is_compiled_vsm(src):
+                    compile_vsm(src)
+                compiled = src
+            else:
+                self.variant = compiled.split("/")[-1]
+            matrix_path, vocab_path = get_compiled_vsm(compiled)
+            self.matrix = np.load(matrix_path, mmap_mode="r")
+            if self.matrix.dtype == np.int8:
+                self.scale = np.load(get_vsm_scale(compiled))
+            with open(vocab_path) as f:
+                for i, word in enumerate(f):
+                    word = word.rstrip("\n")
+                    if word:
+                        self.vocab[word] = i  # duplicate words: the last one wins
+            self.dim = self.matrix.shape[1]
         else:
             self.dim = 1
 
+    def get_ids(self, words):  # matrix rows of the (lowercased) words, -1 for unknown words
+        return np.array([self.vocab.get(word.lower(), -1) for word in words], dtype=np.int64)
+
+    def get_rows(self, ids):  # float32 matrix rows, dequantized
+        rows = self.matrix[ids].astype(np.float32)
+        if self.scale is not None:
+            rows *= self.scale[ids][:, None]
+        return rows
+
     def get(self, word):
         word = word.lower()
-        if word in self.map:
-            return self.map[word]
+        if word in self.vocab:
+            return self.get_rows([self.vocab[word]])[0]
         else:
-            return np.zeros(self.dim, dtype=np.float32)
\ No newline at end of file
+            return np.zeros(self.dim, dtype=np.float32)
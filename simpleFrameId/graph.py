@@ -1,25 +1,245 @@
-import networkx as nx
+from array import array
 
-class DependencyGraph:
-    def __init__(self, nodes, edges):
-        """ Initialize a dependency graph from a list of nodes and a list of edges
+
+class StringTable(object):
+    """ Interns strings as small integer ids, so that graphs can store words and labels in int arrays """
+    __slots__ = ["ids", "strings"]
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def get_id(self, s):
+        i = self.ids.get(s)
+        if i is None:
+            i = len(self.strings)
+            self.ids[s] = i
+            self.strings.append(s)
+        return i
+
+    def get_string(self, i):
+        return self.strings[i]
+
+
+class Sentence(object):
+    __slots__ = ["words", "heads", "labels", "strings", "child_offsets", "children", "sent",
+                 "dfs_order", "dfs_start", "dfs_end", "path_index", "all_paths"]
+
+    def __init__(self, nodes, edges, strings=None):
+        """ Initialize a parsed sentence from a list of nodes and a list of edges
 			Nodes are represented as a dictionary {node_id:word, ...}
-			Edges are a list of triples [(src_id, tgt_id, label), ...] """
-        self.G = nx.DiGraph()
+			Edges are a list of triples [(src_id, tgt_id, label), ...]
+			Node ids index flat arrays of word ids, head ids and label ids (-1 = none), node 0 is the ROOT.
+			Ids refer to the string table, shared by the sentences of a corpus or private to the sentence if None.
+			A sentence is shared by the graphs of all its predicates and must not be modified """
+        self.strings = strings if strings is not None else StringTable()
+        size = max([0] + list(nodes.keys()) + [edge[0] for edge in edges]) + 1
+        self.words = array("i", [-1]) * size
         for node_id in nodes:
-            self.G.add_node(node_id, word=nodes[node_id])
-        self.G.add_node(0, word="ROOT")
+            self.words[node_id] = self.strings.get_id(nodes[node_id])
+        self.words[0] = self.strings.get_id("ROOT")
+        self.heads = array("i", [-1]) * size
+        self.labels = array("i", [-1]) * size
         for edge in edges:
             label = edge[2]
             # add prepositions to labels
             if label == 'prep':
-                label += "_" + self.G.node[edge[1]]["word"].lower()
-            self.G.add_edge(edge[0], edge[1], label=label)
+                label += "_" + nodes[edge[1]].lower()
+            self.heads[edge[1]] = edge[0]
+            self.labels[edge[1]] = self.strings.get_id(label)
+
+        self.index_children()
+        self.sent = " ".join(nodes[nid] for nid in sorted(list(nodes.keys())))
+        self.clear_index()
+
+    @classmethod
+    def from_arrays(cls, words, heads, labels, sent, strings):
+        """ Initialize a parsed sentence directly from its arrays, e.g. loaded from a compiled corpus """
+        sentence = cls.__new__(cls)
+        sentence.words = words
+        sentence.heads = heads
+        sentence.labels = labels
+        sentence.strings = strings
+        sentence.index_children()
+        sentence.sent = sent
+        sentence.clear_index()
+        return sentence
+
+    def index_children(self):
+        """ Children index: dependents of node n are children[child_offsets[n]:child_offsets[n+1]], in id order """
+        size = len(self.words)
+        self.child_offsets = array("i", [0]) * (size + 1)
+        for head in self.heads:
+            if head >= 0:
+                self.child_offsets[head + 1] += 1
+        for n in range(size):
+            self.child_offsets[n + 1] += self.child_offsets[n]
+        self.children = array("i", [0]) * self.child_offsets[size]
+        filled = array("i", self.child_offsets[:-1])
+        for n in range(size):
+            head = self.heads[n]
+            if head >= 0:
+                self.children[filled[head]] = n
+                filled[head] += 1
+
+    def clear_index(self):
+        self.dfs_order = None
+        self.dfs_start = None
+        self.dfs_end = None
+        self.path_index = None
+        self.all_paths = None
+
+    def check_node(self, node):
+        if node is None or node < 0 or node >= len(self.words) or self.words[node] < 0:
+            raise KeyError(node)
 
+    def get_nodes(self):
+        """ Ids of all nodes in the graph, ROOT included """
+        return [n for n in range(len(self.words)) if self.words[n] >= 0 or self.heads[n] >= 0 or
+                self.child_offsets[n] != self.child_offsets[n + 1]]
+
+    def get_word(self, node):
+        self.check_node(node)
+        return self.strings.get_string(self.words[node])
+
+    def get_parent(self, node):
+        """ Get the head of a node, None for the ROOT """
+        head = self.heads[node]
+        return head if head >= 0 else None
+
+    def get_label(self, node):
+        """ Get the label of the incoming relation of a node, None for the ROOT """
+        label = self.labels[node]
+        return self.strings.get_string(label) if label >= 0 else None
+
+    def get_direct_dependents(self, node):
+        """ Get direct dependents of a node """
+        return list(self.children[self.child_offsets[node]:self.child_offsets[node + 1]])
+
+    def traverse(self):
+        """ Internal function that walks the tree once, depth-first from the roots
+			Node n comes at dfs_start[n] in dfs_order, followed by its descendants up to dfs_end[n] (exclusive),
+			so ancestor tests are O(1). Nodes on a cycle (broken parses) are never reached and keep start -1 """
+        size = len(self.words)
+        self.dfs_order = array("i")
+        self.dfs_start = array("i", [-1]) * size
+        self.dfs_end = array("i", [-1]) * size
+        for root in range(size):
+            if self.heads[root] < 0:
+                stack = [(root, False)]
+                while stack:
+                    node, finished = stack.pop()
+                    if finished:
+                        self.dfs_end[node] = len(self.dfs_order)
+                        continue
+                    self.dfs_start[node] = len(self.dfs_order)
+                    self.dfs_order.append(node)
+                    stack.append((node, True))
+                    for child in reversed(self.get_direct_dependents(node)):
+                        stack.append((child, False))
+
+    def is_ancestor(self, src, tgt):  # src == tgt counts as well
+        if self.dfs_order is None:
+            self.traverse()
+        return self.dfs_start[src] >= 0 and self.dfs_start[src] <= self.dfs_start[tgt] < self.dfs_end[src]
+
+    def get_path(self, src, tgt):
+        """ Get path from the source node (id) to the target node (id)
+			Path is represented as a list of dependency relations concatenated by "->" """
+        if self.heads[src] == tgt and tgt!=0:  # don't want the ROOT
+            return "-1"  # the parent relation
+        if not self.is_ancestor(src, tgt):  # dependency paths only go down the tree
+            return None
+        dep_labels = []
+        node = tgt
+        while node != src:  # climb up from the target
+            dep_labels += [self.get_label(node)]
+            node = self.heads[node]
+        return "->".join(reversed(dep_labels))
+
+    def create_pathmap(self):
+        """ Internal function that indexes the paths between all possible node pairs in the graph
+			Paths from a node to its descendants are built incrementally in one pass over its subtree,
+			the index maps (source, path) to the target nodes """
+        if self.dfs_order is None:
+            self.traverse()
+        self.path_index = {}
+        for src in self.get_nodes():
+            parent = self.heads[src]
+            if parent > 0:
+                self.path_index[(src, "-1")] = [parent]  # the parent relation, not for the ROOT
+            if self.dfs_start[src] < 0:
+                continue
+            paths = {}
+            for tgt in self.dfs_order[self.dfs_start[src]+1:self.dfs_end[src]]:  # parents come before children
+                head = self.heads[tgt]
+                paths[tgt] = self.get_label(tgt) if head == src else paths[head] + "->" + self.get_label(tgt)
+                key = (src, paths[tgt])
+                if key not in self.path_index:
+                    self.path_index[key] = []
+                self.path_index[key] += [tgt]
+        for targets in self.path_index.values():
+            targets.sort()
+        self.all_paths = set(path for (_, path) in self.path_index)
+
+    def find_node(self, src, path):
+        """ Find node in a graph given the source and the path """
+        if path == '':
+            return [src]
+        if self.path_index is None:
+            self.create_pathmap()
+        if path not in self.all_paths:
+            return None
+        res = self.path_index.get((src, path))
+        return list(res) if res is not None else None
+
+    def get_node_label(self,
+                       node_id):
+        """ Get node label given the node id
+			If it's a preposition, take the noun it points to! """
+        if self.heads[node_id] >= 0:
+            label = self.get_label(node_id)  # check the label
+            if label.startswith("prep"):
+                succ = self.get_direct_dependents(node_id)
+                if len(succ) == 0:
+                    return "#ERR"  # no successor? That's weird!
+                else:
+                    pobj = succ[0]  # here we assume that a preposition has only one successor, the pobj
+                    return self.get_word(pobj)
+        return self.get_word(node_id)
+
+    def get_head(self, nodes):
+        """ Get the head node for a role span.
+		First, try to find a node with outgoing arc.
+		If none found, pick the node with most dependents inside the span """
+        head = None # leftmost node is default
+        if len(nodes) == 1:
+            head = nodes[0]
+        else:
+            for node_id in nodes:
+                self.check_node(node_id)
+                parent = self.heads[node_id]
+                if parent < 0:
+                    raise IndexError("Node %d has no head" % node_id)
+                if parent not in nodes:
+                    head = node_id
+                    break
+        return head
+
+
+class DependencyGraph(object):
+    __slots__ = ["sentence", "predicate_head", "predicate_nodes", "frame", "lemmapos", "roles", "role_labels", "gid"]
+
+    def __init__(self, sentence):
+        """ Initialize a dependency graph for one predicate of a parsed sentence
+			The graph only stores the predicate-argument structure, the tokens and edges live in the shared Sentence """
+        self.sentence = sentence
         self.predicate_head = None
         self.predicate_nodes = None
+        self.frame = None
+        self.lemmapos = None
         self.roles = None
-        self.sent = " ".join(nodes[nid] for nid in sorted(list(nodes.keys())))
+        self.role_labels = None
         self.gid = None
 
     def add_srl(self, predicate_node, role_nodes):
@@ -31,117 +251,108 @@ class DependencyGraph:
         if (self.predicate_head is not None) or (self.roles is not None):
             raise Exception("Each graph must contain only one predicate-argument structure")
         for x in predicate_node[0]:
-            self.G.node[int(x)]["frame"] = predicate_node[1]
-            self.G.node[int(x)]["lemmapos"] = predicate_node[2]
+            self.sentence.check_node(int(x))
             self.predicate_nodes += [int(x)]
+        self.frame = predicate_node[1]
+        self.lemmapos = predicate_node[2]
         self.predicate_head = predicate_node[0][0]
         self.roles = []
+        self.role_labels = {}
         node_groups = {}  #group nodes by role
         for node_id in role_nodes:
             node_groups[role_nodes[node_id]] = node_groups.get(role_nodes[node_id], []) + [node_id]
         for role in node_groups:
             head = self.get_head(node_groups[role])
-            self.G.node[head]["role"] = role
+            self.sentence.check_node(head)
+            self.role_labels[head] = role
             self.roles += [head]
 
+    def set_srl(self, predicate_nodes, frame, lemmapos, roles):
+        """ Set SRL information as produced by add_srl, e.g. loaded from a compiled corpus
+			Roles are given as a list of (head node_id, role) """
+        self.predicate_nodes = list(predicate_nodes)
+        self.predicate_head = self.predicate_nodes[0]
+        self.frame = frame
+        self.lemmapos = lemmapos
+        self.roles = [head for head, _ in roles]
+        self.role_labels = dict(roles)
+
+    @property
+    def sent(self):
+        return self.sentence.sent
+
+    @property
+    def path_index(self):
+        return self.sentence.path_index
+
+    @property
+    def all_paths(self):
+        return self.sentence.all_paths
+
+    def get_nodes(self):
+        return self.sentence.get_nodes()
+
+    def get_word(self, node):
+        return self.sentence.get_word(node)
+
+    def get_parent(self, node):
+        return self.sentence.get_parent(node)
+
+    def get_label(self, node):
+        return self.sentence.get_label(node)
+
+    def get_role(self, node):
+        return self.role_labels.get(node) if self.role_labels is not None else None
+
+    def is_predicate_node(self, node):
+        return self.predicate_nodes is not None and node in self.predicate_nodes
+
+    def get_attributes(self, node):
+        """ Node attributes as a dictionary: word, and frame, lemmapos, role where present """
+        attributes = {"word": self.get_word(node)}
+        if self.is_predicate_node(node):
+            attributes["frame"] = self.frame
+            attributes["lemmapos"] = self.lemmapos
+        if self.get_role(node) is not None:
+            attributes["role"] = self.get_role(node)
+        return attributes
+
     def pretty(self):
         """ Pretty-print the graph """
         s = ""
-        for n in self.G.nodes():
-            if self.G.node[n] != {}:
+        for n in self.get_nodes():
+            if self.sentence.words[n] >= 0:
                 gid = str(self.gid) if self.gid!=None else "NOID"
-                word = self.G.node[n]["word"]
-                head = self.G.predecessors(n)[0] if len(self.G.predecessors(n)) > 0 else "_"
-                dep_label = self.G[head][n]["label"] if len(self.G.predecessors(n)) > 0 else "_"
-                role = self.G.node[n].get("role", "_")
-                pred = self.G.node[n].get("frame", "_")
+                word = self.get_word(n)
+                head = self.get_parent(n)
+                dep_label = self.get_label(n) if head is not None else "_"
+                head = head if head is not None else "_"
+                role = self.get_role(n) or "_"
+                pred = self.frame if self.is_predicate_node(n) else "_"
                 s += "\t".join([x for x in [str(gid), str(n), word, str(head), dep_label, role, pred]])+"\n"
         return s
 
     def get_predicate_head(self):
-        return self.G.node[self.predicate_head]
+        return self.get_attributes(self.predicate_head)
 
     def get_predicate_node_words(self):
-        return [self.G.node[x]["word"].lower() for x in self.predicate_nodes]
+        return [self.get_word(x).lower() for x in self.predicate_nodes]
 
     def get_direct_dependents(self, node):
-        """ Get direct dependents of a node """
-        return self.G.successors(node)
+        return self.sentence.get_direct_dependents(node)
 
     def get_path(self, src, tgt):
-        """ Get path from the source node (id) to the target node (id)
-			Path is represented as a list of dependency relations concatenated by "->" """
-        edges = None
-        if tgt in self.G.predecessors(src) and tgt!=0:  # don't want the ROOT
-            return "-1"  # the parent relation
-        try:
-            edges = nx.shortest_path(self.G, src, tgt)
-        except nx.exception.NetworkXNoPath:
-            edges = None
-        finally:
-            if edges is not None:
-                dep_labels = [self.G[edges[n]][edges[n + 1]]["label"] for n in range(len(edges) - 1)]
-                return "->".join(dep_labels)
-            else:
-                return None
+        return self.sentence.get_path(src, tgt)
 
     def create_pathmap(self):
-        """ Internal function that calculates paths between all possible node pairs in the graph """
-        self.pathmap = {}
-        self.all_paths = []
-        for n1 in self.G.nodes():
-            self.pathmap[n1] = {}
-            for n2 in self.G.nodes():
-                if n1 != n2:
-                    path = self.get_path(n1, n2)
-                    if path is not None:
-                        p = self.get_path(n1, n2)
-                        self.pathmap[n1][n2] = p
-                        self.all_paths += [p]
-        self.all_paths = set(self.all_paths)
+        if self.sentence.path_index is None:  # computed once per sentence
+            self.sentence.create_pathmap()
 
     def find_node(self, src, path):
-        """ Find node in a graph given the source and the path """
-        res = []
-        if path == '':
-            return [src]
-        if path not in self.all_paths:
-            return None
-        for tgt in self.G.nodes():
-            if tgt != src:
-                if self.pathmap[src] is not None:
-                    if tgt in self.pathmap[src]:
-                        if self.pathmap[src][tgt] == path:
-                            res += [tgt]
-        return res if len(res) > 0 else None
+        return self.sentence.find_node(src, path)
 
-    def get_node_label(self,
-                       node_id):
-        """ Get node label given the node id
-			If it's a preposition, take the noun it points to! """
-        in_rel = self.G.in_edges(node_id)
-        if in_rel is not None and len(in_rel)>0:
-            label = self.G[in_rel[0][0]][in_rel[0][1]]["label"]  # check the label
-            if label.startswith("prep"):
-                succ = self.G.successors(in_rel[0][1])
-                if succ is None or len(succ) == 0:
-                    return "#ERR"  # no successor? That's weird!
-                else:
-                    pobj = self.G.successors(in_rel[0][1])[0]  # here we assume that a preposition has only one successor, the pobj
-                    return self.G.node[pobj]["word"]
-        return self.G.node[node_id]["word"]
+    def get_node_label(self, node_id):
+        return self.sentence.get_node_label(node_id)
 
     def get_head(self, nodes):
-        """ Get the head node for a role span.
-		First, try to find a node with outgoing arc.
-		If none found, pick the node with most dependents inside the span """
-        head = None # leftmost node is default
-        if len(nodes) == 1:
-            head = nodes[0]
-        else:
-            for node_id in nodes:
-                parent = self.G.predecessors(node_id)[0]
-                if parent not in nodes:
-                    head = node_id
-                    break
-        return head
+        return self.sentence.get_head(nodes)
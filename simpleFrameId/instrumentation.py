@@ -0,0 +1,55 @@
+import os, time, json, resource
+from contextlib import contextmanager
+
+# Lightweight instrumentation: named spans of work with wall time, CPU time and peak memory
+
+SPANS = ["load_lexicon", "load_vsm", "load_model", "parse_corpus", "featurize", "train", "predict", "report"]  # reported in the summary
+
+
+def peak_rss_mb():  # peak resident memory of the process so far
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.  # kilobytes on Linux
+
+
+def cpu_time():  # user + system time of the process, all threads
+    t = os.times()
+    return t[0] + t[1]
+
+
+class Spans:
+    def __init__(self, *parents):
+        self.records = []  # [{span, wall_s, cpu_s, peak_rss_mb, ...}] in order of completion
+        for parent in parents:  # e.g. the training spans of an evaluation
+            self.records += parent.records
+
+    @contextmanager
+    def span(self, name, **info):
+        start_wall, start_cpu = time.time(), cpu_time()
+        try:
+            yield
+        finally:
+            record = {"span": name, "wall_s": time.time() - start_wall, "cpu_s": cpu_time() - start_cpu,
+                      "peak_rss_mb": peak_rss_mb()}
+            record.update(info)
+            self.records += [record]
+
+    def add(self, name, wall_s, cpu_s, **info):  # span measured elsewhere, e.g. a share of work done for several runs
+        record = {"span": name, "wall_s": wall_s, "cpu_s": cpu_s, "peak_rss_mb": peak_rss_mb()}
+        record.update(info)
+        self.records += [record]
+
+    def totals(self):  # {name: (wall, cpu)} summed over the spans with the same name
+        totals = {}
+        for record in self.records:
+            wall, cpu = totals.get(record["span"], (0., 0.))
+            totals[record["span"]] = (wall + record["wall_s"], cpu + record["cpu_s"])
+        return totals
+
+    def peak_rss_mb(self):
+        return max([record["peak_rss_mb"] for record in self.records] + [0.])
+
+    def write(self, path, **context):  # structured log, one JSON object per span with the context added
+        with open(path, "w") as f:
+            for record in self.records:
+                record = dict(record)
+                record.update(context)
+                f.write(json.dumps(record, sort_keys=True) + "\n")
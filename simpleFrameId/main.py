@@ -1,22 +1,28 @@
 from globals import *
-from data import get_graphs
-from extras import Lexicon, VSM
 from representation import DependentsBowMapper, SentenceBowMapper, DummyMapper
-from classifier import SharingDNNClassifier, DataMajorityBaseline, LexiconMajorityBaseline, WsabieClassifier
-from evaluation import Score
+from classifier import SharingDNNClassifier, DataMajorityBaseline, LexiconMajorityBaseline, WsabieClassifier, TrainingController
 from reporting import ReportManager
 from config import Config
 from resources import ResourceManager
-import time
-from numpy import random
+from scheduler import Scheduler
+import multiprocessing
 
 HOME = "/home/local/UKP/martin/repos/frameID/"  # adjust accordingly
+CACHE_BUDGET = 8*1024**3  # memory budget (bytes) for lexicons, VSMs and corpora shared between configurations
+PRUNE_VSM = True  # keep only the VSM rows of words that occur in CORPORA_ALL
+WORKERS = multiprocessing.cpu_count()  # number of worker processes, each trains and evaluates one configuration at a time
+RESUME = True  # keep finished runs from a previous (interrupted) sweep in the output folder and skip them
+SEED = 4  # random seed, fixed for each training
+COMPRESS_REPORTS = False  # gzip the per-instance result and conll files
+EVALUATE_ONLY = False  # evaluate the models saved in ROOT/models by a previous run instead of training
+VALIDATION_SPLIT = 0.1  # part of the training instances held out to choose the epoch of the DNN and WSABIE classifiers
+PATIENCE = 20  # stop training after this many epochs without better validation accuracy, None: run all epochs
+TIME_BUDGET = None  # maximum training time (seconds) per model, None: no limit
 
 if __name__ == "__main__":
 
-    random.seed(4)  # fix the random seed
-
     vsms = [EMBEDDINGS_LEVY_DEPS_300]  # vector space model to use
+    # add e.g. EMBEDDINGS_LEVY_DEPS_300 + ":int8" (or ":float16") for a quantized copy, compared to float32 in ROOT/out/quantization
     lexicons = [LEXICON_FULL_BRACKETS_FIX]  # lexicon to use (mind the all_unknown setting!)
     multiword_averaging = [False]  # treatment of multiword predicates, false - use head embedding, true - use avg
     all_unknown = [False, True]  # makes the lexicon treat all LU as unknown, corresponds to the no-lex setting
@@ -53,89 +59,19 @@ if __name__ == "__main__":
                                 configs += [Config(WsabieClassifier, DependentsBowMapper, lexicon, vsm, mwa, all_unk, num_comp, max_sampl, num_ep)]
 
     print "Starting resource manager"
-    sources = ResourceManager(HOME)
+    sources = ResourceManager(HOME, CACHE_BUDGET, CORPORA_ALL if PRUNE_VSM else None)
 
     print "Initializing reporters"
-    reports = ReportManager(sources.out)
+    reports = ReportManager(sources.out, clean=not RESUME, compress=COMPRESS_REPORTS)
 
     print "Running the experiments!"
     runs = len(configs)*len(CORPORA_TRAIN)*len(CORPORA_TEST)
     print len(configs), "configurations, ", len(CORPORA_TRAIN)*len(CORPORA_TEST), " train-test pairs -> ", \
         runs, " runs"
 
-    current_train = 0
-    current_config = 0
-    current_test = 0
-    for corpus_train in CORPORA_TRAIN:
-        current_train += 1
-        current_config = 0
-
-        g_train = get_graphs(*sources.get_corpus(corpus_train))
-        reports.conll_reporter_train.report(g_train)
-
-        for conf in configs:
-            current_config += 1
-            start_time = time.time()
-
-            lexicon = Lexicon()
-            # go to configuration, check which lexicon is needed, locate the lexicon in FS, load the lexicon
-            lexicon.load_from_list(sources.get_lexicon(conf.get_lexicon()))
-            reports.lexicon_reporter.report(lexicon)
-
-            # same for VSM
-            vsm = VSM(sources.get_vsm(conf.get_vsm()))
-            mapper = conf.get_feat_extractor()(vsm, lexicon)
-
-            # prepare the data
-            X_train, y_train, lemmapos_train, gid_train = mapper.get_matrix(g_train)
-
-            # train the model
-            clf = conf.get_clf()(lexicon, conf.get_all_unknown(), conf.get_num_components(), conf.get_max_sampled(),
-                                 conf.get_num_epochs())
-            clf.train(X_train, y_train, lemmapos_train)
-
-            current_test = 0
-            for corpus_test in CORPORA_TEST:
-                score = Score()  # storage for scores
-                score_v = Score()  # storage for verb-only scores
-                score_known = Score()  # storage for known lemma-only scores
-
-                start_time = time.time()
-
-                reports.set_config(conf, corpus_train, corpus_test)
-
-                current_test += 1
-
-                # prepare test data
-                g_test = get_graphs(*sources.get_corpus(corpus_test))
-                reports.conll_reporter_test.report(g_test)
-                X_test, y_test, lemmapos_test, gid_test = mapper.get_matrix(g_test)
-
-                # predict and compare
-                for x, y_true, lemmapos, gid, g in zip(X_test, y_test, lemmapos_test, gid_test, g_test):
-                    y_predicted = clf.predict(x, lemmapos)
-                    correct = y_true == y_predicted
-
-                    score.consume(correct, lexicon.is_ambiguous(lemmapos), lexicon.is_unknown(lemmapos), y_true)
-                    if lemmapos.endswith(".v"):
-                        score_v.consume(correct, lexicon.is_ambiguous(lemmapos), lexicon.is_unknown(lemmapos), y_true)
-                    if not lexicon.is_unknown(lemmapos):
-                        score_known.consume(correct, lexicon.is_ambiguous(lemmapos), lexicon.is_unknown(lemmapos), y_true)
-
-                    reports.result_reporter.report(gid, g, lemmapos, y_predicted, y_true, lexicon)
-                reports.summary_reporter.report(corpus_train, corpus_test, conf, score, time.time() - start_time)
-                reports.summary_reporter_v.report(corpus_train, corpus_test, conf, score_v, time.time() - start_time)
-                reports.summary_reporter_known.report(corpus_train, corpus_test, conf, score_known, time.time() - start_time)
-
-                print "============ STATUS: - train", current_train, "/", len(CORPORA_TRAIN), \
-                    "conf", current_config, "/", len(configs),\
-                    "test", current_test, "/", len(CORPORA_TEST)
-
-
-
-
-
-
-
-
-
+    controller = TrainingController(VALIDATION_SPLIT, PATIENCE, TIME_BUDGET)
+    scheduler = Scheduler(sources, reports, configs, CORPORA_TRAIN, CORPORA_TEST, WORKERS, SEED, EVALUATE_ONLY, controller)
+    try:
+        scheduler.run()
+    finally:
+        reports.close()
@@ -1,58 +1,206 @@
-import codecs, os, shutil
+import codecs, os, shutil, gzip, sys, threading, Queue
+import numpy as np
 from evaluation import acc
+from instrumentation import SPANS
+from extras import split_vsm_name
 
 # Reporting classes
 
-class ReportManager:
-    def __init__(self, report_folder):
-        if os.path.exists(report_folder):
+class ReportManager:  # owns the reporters of an experiment, close() must be called at the end
+    def __init__(self, report_folder, clean=True, compress=False):
+        if clean and os.path.exists(report_folder):
             shutil.rmtree(report_folder)
-        os.makedirs(report_folder)
+        if not os.path.exists(report_folder):
+            os.makedirs(report_folder)
         self.report_folder = report_folder
-        self.result_reporter = ResultReporter(os.path.join(self.report_folder, "results"))
-        self.lexicon_reporter = LexiconReporter(os.path.join(self.report_folder, "lexicon"))
-        self.conll_reporter_train = ConllReporter(os.path.join(self.report_folder, "train.conll"))
-        self.conll_reporter_test = ConllReporter(os.path.join(self.report_folder, "test.conll"))
-        self.summary_reporter = ResultSummaryReporter(os.path.join(self.report_folder, "summary"))
-        self.summary_reporter_v = ResultSummaryReporter(os.path.join(self.report_folder, "summary_v"))
-        self.summary_reporter_known = ResultSummaryReporter(os.path.join(self.report_folder, "summary_known"))
+        self.compress = compress  # gzip the per-instance reports (results, conll)
+        self.reporters = []
+        self.result_reporter = self.add(ResultReporter(os.path.join(self.report_folder, "results"), compress))
+        self.lexicon_reporter = self.add(LexiconReporter(os.path.join(self.report_folder, "lexicon")))
+        self.conll_reporter_train = self.add(ConllReporter(os.path.join(self.report_folder, "train.conll"), compress))
+        self.conll_reporter_test = self.add(ConllReporter(os.path.join(self.report_folder, "test.conll"), compress))
+        self.summary_reporter = self.add(ResultSummaryReporter(os.path.join(self.report_folder, "summary")))
+        self.summary_reporter_v = self.add(ResultSummaryReporter(os.path.join(self.report_folder, "summary_v")))
+        self.summary_reporter_known = self.add(ResultSummaryReporter(os.path.join(self.report_folder, "summary_known")))
+        self.span_reporter = self.add(SpanReporter(os.path.join(self.report_folder, "spans.jsonl")))
+        self.quantization_reporter = self.add(QuantizationReporter(os.path.join(self.report_folder, "quantization")))
+
+    def add(self, reporter):
+        self.reporters += [reporter]
+        return reporter
+
+    def replace(self, old, new):
+        old.close()
+        self.reporters.remove(old)
+        return self.add(new)
 
     def set_config(self, config, train, test):
-        self.result_reporter = ResultReporter(os.path.join(self.report_folder, "results_"+train+"_"+test+"_"+str(config)))
-        self.lexicon_reporter = LexiconReporter(os.path.join(self.report_folder, "lexicon_"+config.lexicon if config.lexicon is not None else "NA"))
+        self.result_reporter = self.replace(self.result_reporter, ResultReporter(os.path.join(self.report_folder, "results_"+train+"_"+test+"_"+str(config)), self.compress))
+        self.lexicon_reporter = self.replace(self.lexicon_reporter, LexiconReporter(os.path.join(self.report_folder, "lexicon_"+config.lexicon if config.lexicon is not None else "NA")))
+
+    def flush(self):  # everything reported so far is on disk
+        for reporter in self.reporters:
+            reporter.flush()
+
+    def close(self):
+        for reporter in self.reporters:
+            reporter.close()
+        self.reporters = []
+
+
+def text(s):
+    return s
+
+
+class ReportWriter(threading.Thread):
+    """ Background writer of a reporter: records wait in a bounded queue (the reporting side blocks when it is full)
+        and are formatted and written by this thread in batches, so report I/O overlaps with computation """
+    def __init__(self, out, max_queue=10000, batch_size=1000):
+        super(ReportWriter, self).__init__()
+        self.out = out
+        self.queue = Queue.Queue(max_queue)
+        self.batch_size = batch_size
+        self.error = None
+        self.daemon = True
+        self.start()
+
+    def put(self, fmt, args):  # fmt(*args) gives the text to write
+        self.queue.put((fmt, args))
+
+    def flush(self):
+        done = threading.Event()
+        self.queue.put((None, done))
+        done.wait()
+        self.check()
+
+    def close(self):
+        self.queue.put((None, None))
+        self.join()
+        self.check()
+
+    def check(self):  # raise the error of the writer thread in the reporting thread
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error[0], error[1], error[2]
+
+    def run(self):
+        stop = False
+        while not stop:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch += [self.queue.get_nowait()]
+                except Queue.Empty:
+                    break
+            lines = []
+            for fmt, args in batch:
+                if fmt is not None:
+                    if self.error is None:
+                        try:
+                            lines += [fmt(*args)]
+                        except Exception:
+                            self.error = sys.exc_info()
+                    continue
+                self.write(lines)
+                lines = []
+                if args is None:  # close
+                    stop = True
+                else:  # flush
+                    args.set()
+            self.write(lines)
+
+    def write(self, lines):
+        if len(lines) > 0 and self.error is None:
+            try:
+                self.out.write("".join(lines))
+                self.out.flush()
+            except Exception:
+                self.error = sys.exc_info()
 
 
 class Reporter(object):
-    def __init__(self, out_path):
-        self.out = codecs.open(out_path, "w", "utf-8")
+    background = True  # write in a background thread
+
+    def __init__(self, out_path, compress=False):
+        if compress:
+            self.out = codecs.getwriter("utf-8")(gzip.open(out_path + ".gz", "wb"))
+        else:
+            self.out = codecs.open(out_path, "w", "utf-8")
+        self.writer = ReportWriter(self.out) if self.background else None
         if hasattr(self, 'columns'):
             self.write_header()
 
+    def write(self, fmt, *args):  # fmt(*args) is the text to write, formatted in the background if possible
+        if self.writer is not None:
+            self.writer.put(fmt, args)
+        else:
+            self.out.write(fmt(*args))
+
     def write_header(self):
-        self.out.write("\t".join(self.columns)+"\n")
+        self.write(text, "\t".join(self.columns)+"\n")
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
+        self.out.flush()
+
     def close(self):
-        self.out.close()
+        if self.out.closed:
+            return
+        try:
+            if self.writer is not None:
+                self.writer.close()
+        finally:
+            self.out.close()
+
+    def has_columns(self, src):  # another report has the columns of this one, e.g. was not written by an older version
+        try:
+            with codecs.open(src, "r", "utf-8") as f:
+                return f.readline().rstrip("\n").split("\t") == self.columns
+        except IOError:
+            return False
+
+    def copy_rows(self, src):  # append the rows of another report with the same columns, without its header
+        with codecs.open(src, "r", "utf-8") as f:
+            if hasattr(self, 'columns'):
+                f.readline()
+            for line in f:
+                self.write(text, line)
 
 
 class ResultReporter(Reporter):
-    def __init__(self, out_path):
+    def __init__(self, out_path, compress=False):
         self.columns = ["gid", "sent", "lemmapos", "pos", "predicted_id", "true_id", "predicted_frame", "true_frame", "ambig", "unknown"]
-        super(self.__class__, self).__init__(out_path)
+        super(self.__class__, self).__init__(out_path, compress)
 
     def report(self, instance_id, g, lemmapos, predicted, true, lexicon):
-        self.out.write("\t".join([str(instance_id), g.sent,
-                                  lemmapos, lemmapos.split(".")[1],
-                                  str(predicted), str(true), lexicon.get_frame(predicted), lexicon.get_frame(true),
-                                  str(lexicon.is_ambiguous(lemmapos)), str(lexicon.is_unknown(lemmapos))])+"\n")
+        self.write(self.format, instance_id, g, lemmapos, predicted, true, lexicon)
+
+    def format(self, instance_id, g, lemmapos, predicted, true, lexicon):
+        return "\t".join([str(instance_id), g.sent,
+                          lemmapos, lemmapos.split(".")[1],
+                          str(predicted), str(true), lexicon.get_frame(predicted), lexicon.get_frame(true),
+                          str(lexicon.is_ambiguous(lemmapos)), str(lexicon.is_unknown(lemmapos))])+"\n"
 
 
 class ResultSummaryReporter(Reporter):
+    background = False  # one row per run
+
     def __init__(self, out_path):
         self.columns = ["train", "test", "clf", "feats", "lex", "vsm", "MWE_avg", "all_unk", "num_components", "max_sampled", "num_epochs", "total", "correct", "ambig", "ambig_correct", "unambig", "unambig_correct", "unk", "unk_correct",
-                        "total_acc", "ambig_acc", "unambig_acc", "unk_acc", "time"]
+                        "total_acc", "ambig_acc", "unambig_acc", "unk_acc", "time"] + \
+                       [span + x for span in SPANS for x in ["_wall", "_cpu"]] + ["peak_rss_mb"] + \
+                       ["best_epoch", "epochs_trained", "train_time_saved"]
         super(self.__class__, self).__init__(out_path)
 
-    def report(self, train, test, config, score, time_delta):
+    def report(self, train, test, config, score, time_delta, spans=None, training=None):
+        """ spans: instrumentation.Spans of the run, training: TrainingController info of the classifier """
+        totals = spans.totals() if spans is not None else {}
+        span_columns = []
+        for span in SPANS:
+            span_columns += [str(x) for x in totals[span]] if span in totals else ["NA", "NA"]
+        span_columns += [str(spans.peak_rss_mb()) if spans is not None else "NA"]
+        training_columns = [str(training[x]) for x in ["best_epoch", "epochs", "time_saved"]] if training is not None else ["NA"] * 3
         self.out.write(
             "\t".join([train, test, config.clf.__name__, config.feat_extractor.__name__, config.lexicon if config.lexicon is not None else "NA",
                        config.vsm if config.vsm is not None else "NA", str(config.multiword_averaging), str(config.all_unknown), 
@@ -63,11 +211,13 @@ class ResultSummaryReporter(Reporter):
                        str(score.correct_unambig), str(score.total_unknown), str(score.correct_unknown),
                        str(acc(score.correct, score.total)), str(acc(score.correct_ambig, score.total_ambig)),
                        str(acc(score.correct_unambig, score.total_unambig)), str(acc(score.correct_unknown, score.total_unknown)),
-                       str(time_delta)])+"\n"
+                       str(time_delta)] + span_columns + training_columns)+"\n"
         )
 
 
 class LexiconReporter(Reporter):
+    background = False
+
     def __init__(self, out_path):
         self.columns = ["lemma", "frames"]
         super(self.__class__, self).__init__(out_path)
@@ -77,7 +227,68 @@ class LexiconReporter(Reporter):
             self.out.write("\t".join([lemma, ", ".join([str(lexicon.get_id(frame))+": "+frame for frame in lexicon.frameLexicon[lemma]])]) + "\n")
 
 
+class FrameReporter(Reporter):  # per-frame scores of one run, with the frame most often predicted instead
+    background = False
+
+    def __init__(self, out_path):
+        self.columns = ["frame_id", "frame", "total", "correct", "acc", "confused_with", "confused_count"]
+        super(self.__class__, self).__init__(out_path)
+
+    def report(self, result, lexicon):
+        num_frames = len(lexicon.idToFrame)
+        totals, corrects = result.frame_counts(num_frames)
+        confusion = result.confusion(num_frames)
+        confusion.setdiag(0)
+        confusion.eliminate_zeros()
+        for frame_id in np.flatnonzero(totals):
+            row = confusion.getrow(frame_id)
+            confused = row.indices[row.data.argmax()] if row.nnz > 0 else -1
+            self.out.write("\t".join([str(frame_id), lexicon.get_frame(frame_id), str(totals[frame_id]), str(corrects[frame_id]),
+                                      str(acc(corrects[frame_id], totals[frame_id])),
+                                      lexicon.get_frame(confused) if confused >= 0 else "NA",
+                                      str(row.data.max()) if row.nnz > 0 else "0"]) + "\n")
+
+
+class QuantizationReporter(Reporter):  # accuracy of runs with a quantized VSM against the same run with float32
+    background = False
+
+    def __init__(self, out_path):
+        self.columns = ["train", "test", "clf", "feats", "lex", "vsm", "precision", "MWE_avg", "all_unk", "num_components",
+                        "max_sampled", "num_epochs", "total_acc", "total_acc_float32", "total_acc_delta",
+                        "ambig_acc_delta", "unambig_acc_delta", "unk_acc_delta"]
+        super(self.__class__, self).__init__(out_path)
+
+    def report(self, summary_path):  # compares the rows of a summary file
+        keys = ["train", "test", "clf", "feats", "lex", "MWE_avg", "all_unk", "num_components", "max_sampled", "num_epochs"]
+        accs = ["total_acc", "ambig_acc", "unambig_acc", "unk_acc"]
+        with codecs.open(summary_path, "r", "utf-8") as f:
+            header = f.readline().rstrip("\n").split("\t")
+            rows = [dict(zip(header, line.rstrip("\n").split("\t"))) for line in f if line.strip()]
+        float32 = {}
+        for row in rows:
+            if row["vsm"] != "NA" and split_vsm_name(row["vsm"])[1] == "float32":
+                float32[tuple(row[key] for key in keys) + (split_vsm_name(row["vsm"])[0],)] = row
+        for row in rows:
+            if row["vsm"] == "NA":
+                continue
+            vsm, precision = split_vsm_name(row["vsm"])
+            base = float32.get(tuple(row[key] for key in keys) + (vsm,))
+            if precision == "float32" or base is None:
+                continue
+            self.out.write("\t".join([row["train"], row["test"], row["clf"], row["feats"], row["lex"], vsm, precision] +
+                                     [row[key] for key in keys[5:]] + [row["total_acc"], base["total_acc"]] +
+                                     [str(float(row[a]) - float(base[a])) for a in accs]) + "\n")
+
+
+class SpanReporter(Reporter):  # structured span log, JSON lines copied from the task logs
+    background = False
+
+
+def pretty_line(g):
+    return g.pretty() + "\n"
+
+
 class ConllReporter(Reporter):
     def report(self, graphs):
         for g in graphs:
-            self.out.write(g.pretty() + "\n")
\ No newline at end of file
+            self.write(pretty_line, g)
\ No newline at end of file
@@ -15,18 +15,27 @@ class FeatureMapper:
     def get_repr_sent(self, words, predicate_id):
         raise NotImplementedError("Not implemented")
 
+    def get_repr_data(self, graph):  # what get_matrix collects per graph, by default the representation itself
+        return self.get_repr(graph)
+
+    def get_repr_matrix(self, data):  # turns the collected data into the feature matrix
+        return np.vstack(data)
+
+    def get_features(self, graph_list):  # feature matrix only, for graphs without frame labels
+        return self.get_repr_matrix([self.get_repr_data(g) for g in graph_list])
+
     def get_matrix(self, graph_list):
         X = []
         y = []
         lemmapos = []
         gid = []
         for g in graph_list:
-            X += [self.get_repr(g)]
+            X += [self.get_repr_data(g)]
             frame = g.get_predicate_head()["frame"]
             y += [self.lexicon.get_id(frame)]
             lemmapos += [g.get_predicate_head()["lemmapos"]]
             gid += [g.gid]
-        X = np.vstack(X)
+        X = self.get_repr_matrix(X)
         y = np.array(y, dtype=np.int)
         return X, y, lemmapos, gid
 
@@ -44,30 +53,116 @@ def avg_embedding(wordlist, emb):
     return np.mean(res, axis=0)
 
 
-class SentenceBowMapper(FeatureMapper):
-    def get_repr(self, graph):
-        words = graph.sent.split(" ")
+def avg_embeddings(wordlists, emb, chunk_size=4096):
+    """ Batch version of avg_embedding, one row per word list
+        Word lists are flattened into one array of VSM rows, gathered in one indexing operation and summed
+        position by position for all lists at once. This adds the rows in the same order as np.mean
+        (np.add.reduceat doesn't), so the result is identical. Empty word lists give zero vectors.
+        Work is done in chunks of word lists to bound the temporary memory, quantized VSMs are converted to
+        float32 per chunk, only for the gathered rows """
+    res = np.zeros((len(wordlists), emb.dim), dtype=np.float32)
+    for chunk_start in range(0, len(wordlists), chunk_size):
+        chunk = wordlists[chunk_start:chunk_start+chunk_size]
+        lengths = np.array([len(wordlist) for wordlist in chunk], dtype=np.int64)
+        ids = emb.get_ids([word for wordlist in chunk for word in wordlist])
+        known = ids >= 0
+        vectors = np.zeros((len(ids), emb.dim), dtype=np.float32)  # unknown words count as zero vectors
+        if known.any():
+            vectors[known] = emb.get_rows(ids[known])
+        offsets = np.cumsum(lengths) - lengths
+        sums = np.zeros((len(chunk), emb.dim), dtype=np.float32)
+        for position in range(lengths.max() if len(chunk) > 0 else 0):
+            rows = np.flatnonzero(lengths > position)
+            sums[rows] += vectors[offsets[rows] + position]
+        res[chunk_start:chunk_start+len(chunk)] = sums / np.maximum(lengths, 1).astype(np.float32)[:, None]
+    return res
+
+
+class BowMapper(FeatureMapper):
+    """ Bag-of-words mappers: average embedding of context words + average embedding of target words
+        Child classes only choose the context words, get_matrix averages all graphs at once """
+    def get_context_words(self, graph):
+        raise NotImplementedError("Not implemented")
+
+    def get_target_words(self, graph):
         if not self.multiword_averaging:
             predicate_head = graph.get_predicate_head()
-            tgt_w = [predicate_head["word"].lower(), ]
+            return [predicate_head["word"].lower(), ]
         else:
-            tgt_w = graph.get_predicate_node_words()
-        return self.get_repr_sent(words, tgt_w)
+            return graph.get_predicate_node_words()
+
+    def get_words(self, graph):  # (context words, target words)
+        return self.get_context_words(graph), self.get_target_words(graph)
+
+    def get_parts(self):
+        """ [(key, words function)] of the averaged parts of the representation, in order.
+            Parts with the same key have the same words for all mappers, see get_matrices """
+        return [(self.__class__.__name__, self.get_context_words), (("target", self.multiword_averaging), self.get_target_words)]
+
+    def get_repr(self, graph):
+        words, tgt_w = self.get_words(graph)
+        return np.concatenate((avg_embedding(words, self.vsm), avg_embedding(tgt_w, self.vsm)), axis=0)
+
+    def get_repr_data(self, graph):
+        return self.get_words(graph)
+
+    def get_repr_matrix(self, data):
+        return np.hstack((avg_embeddings([words for words, _ in data], self.vsm),
+                          avg_embeddings([tgt_w for _, tgt_w in data], self.vsm)))
+
+
+class SentenceBowMapper(BowMapper):
+    def get_context_words(self, graph):
+        return graph.sent.split(" ")
 
     def get_repr_sent(self, words, tgt_w):
         return np.concatenate((avg_embedding(words, self.vsm), avg_embedding(tgt_w, self.vsm)), axis=0)
 
 
-class DependentsBowMapper(FeatureMapper):
-    def get_repr(self, graph):
-        predicate_head = graph.get_predicate_head()
+class DependentsBowMapper(BowMapper):
+    def get_context_words(self, graph):
         deps = graph.get_direct_dependents(graph.predicate_head)
-        parent = graph.G.predecessors(graph.predicate_head)
-        if parent is not None and len(parent)>0:
-            deps += [parent[0]]
-        words = [graph.G.node[n]["word"].lower() for n in deps]
-        if not self.multiword_averaging:
-            tgt_w = [predicate_head["word"].lower(), ]
+        parent = graph.get_parent(graph.predicate_head)
+        if parent is not None:
+            deps += [parent]
+        return [graph.get_word(n).lower() for n in deps]
+
+
+def get_matrices(mappers, graph_list):
+    """ get_matrix of several mappers in a single pass over the graphs, in the order of mappers.
+        Labels are read once per graph, and the parts that bag-of-words mappers share (e.g. the target words
+        with the same multiword_averaging) are collected and averaged once per VSM """
+    frames, lemmapos, gid = [], [], []
+    data = [[] for _ in mappers]  # other mappers: their own get_repr_data
+    words = {}  # part key -> word lists
+    for g in graph_list:
+        predicate_head = g.get_predicate_head()
+        frames += [predicate_head["frame"]]
+        lemmapos += [predicate_head["lemmapos"]]
+        gid += [g.gid]
+        done = set()
+        for i, mapper in enumerate(mappers):
+            if isinstance(mapper, BowMapper):
+                for key, get_words in mapper.get_parts():
+                    if key not in done:
+                        words.setdefault(key, []).append(get_words(g))
+                        done.add(key)
+            else:
+                data[i] += [mapper.get_repr_data(g)]
+    averages = {}  # (part key, VSM) -> matrix
+    labels = {}  # lexicon -> y
+    matrices = []
+    for i, mapper in enumerate(mappers):
+        if isinstance(mapper, BowMapper):
+            parts = []
+            for key, _ in mapper.get_parts():
+                if (key, id(mapper.vsm)) not in averages:
+                    averages[(key, id(mapper.vsm))] = avg_embeddings(words.get(key, []), mapper.vsm)
+                parts += [averages[(key, id(mapper.vsm))]]
+            X = np.hstack(parts)
         else:
-            tgt_w = graph.get_predicate_node_words()
-        return np.concatenate((avg_embedding(words, self.vsm), avg_embedding(tgt_w, self.vsm)), axis=0)
\ No newline at end of file
+            X = mapper.get_repr_matrix(data[i])
+        if id(mapper.lexicon) not in labels:
+            labels[id(mapper.lexicon)] = np.array([mapper.lexicon.get_id(frame) for frame in frames], dtype=np.int)
+        matrices += [(X, labels[id(mapper.lexicon)], lemmapos, gid)]
+    return matrices
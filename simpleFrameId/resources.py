@@ -1,4 +1,11 @@
 import os
+import shutil
+import hashlib
+import numpy as np
+from collections import OrderedDict
+from extras import Lexicon, VSM, is_compiled_vsm, prune_vsm, quantize_vsm, split_vsm_name
+from data import get_graphs, file_digest, scan_vocabulary
+from representation import get_matrices
 
 # Some basic resource management
 # Required folder structure:
@@ -8,15 +15,62 @@ import os
 #           - embeddings        VSMs
 #           - corpora           training and test data
 #           - lexicons          lexicon lists
+#       - models                trained models, one folder per training corpus and configuration
+#       - cache                 derived data, safe to delete
+#           - features          feature matrices
+#           - corpora           compiled corpora
+#           - vsm               pruned and quantized VSMs
+
+class ResourceCache:  # LRU cache for loaded resources, bounded by the estimated size of the cached objects in bytes
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+        self.items = OrderedDict()  # key -> (object, size), least recently used first
+
+    def get(self, key, load, size):
+        if key in self.items:
+            item = self.items.pop(key)
+            self.items[key] = item  # move to the most recently used end
+            return item[0]
+        obj = load()
+        obj_size = size(obj)
+        self.items[key] = (obj, obj_size)
+        self.size += obj_size
+        while self.size > self.budget and len(self.items) > 1:  # never evict the object just loaded
+            old_key, (_, old_size) = self.items.popitem(last=False)
+            self.size -= old_size
+            print "Evicting", old_key, "from resource cache"
+        return obj
+
+    def clear(self):
+        self.items.clear()
+        self.size = 0
+
+
+FEATURE_CACHE_VERSION = 1  # increase when the feature extraction changes in a way the cache key can't see
+
+
+def file_size(*paths):
+    return sum(os.path.getsize(p) for p in paths if p is not None and os.path.exists(p))
+
 
 class ResourceManager:
-    def __init__(self, root):
+    def __init__(self, root, cache_budget=8*1024**3, prune_corpora=None, derived_vsm_paths=None):
+        """ prune_corpora: if given, VSMs are restricted to the words of these corpora, see load_vsm
+            derived_vsm_paths: {(VSM name, precision): path} of the derived VSMs already created, see prepare_vsm """
         self.root = root
         self.out = os.path.join(self.root, "out")
         self.data = os.path.join(self.root, "srl_data")
         self.vsm_folder = os.path.join(self.data, "embeddings")
         self.corpora = os.path.join(self.data, "corpora")
         self.lexicons = os.path.join(self.data, "lexicons")
+        self.cache = ResourceCache(cache_budget)  # loaded resources are shared between configurations
+        self.models = os.path.join(self.root, "models")
+        self.feature_cache = os.path.join(self.root, "cache", "features")
+        self.compiled_corpora = os.path.join(self.root, "cache", "corpora")
+        self.derived_vsms = os.path.join(self.root, "cache", "vsm")
+        self.prune_corpora = prune_corpora
+        self.derived_vsm_paths = dict(derived_vsm_paths) if derived_vsm_paths is not None else {}
 
     def get_corpus(self, corpus_name):
         return (os.path.join(self.corpora, corpus_name+x) for x in [".all.lemma.tags", ".frame.elements"])
@@ -25,4 +79,125 @@ class ResourceManager:
         return os.path.join(self.lexicons, lexicon_name) if lexicon_name is not None else None
 
     def get_vsm(self, vsm_name):
-        return os.path.join(self.vsm_folder, vsm_name) if vsm_name is not None else None
\ No newline at end of file
+        return os.path.join(self.vsm_folder, vsm_name) if vsm_name is not None else None
+
+    def get_model(self, conf, corpus_train, controller=None):  # controller: TrainingController the model is trained with
+        name = corpus_train + "_" + str(conf)
+        if controller is not None and str(controller):
+            name += "__" + str(controller)
+        return os.path.join(self.models, name)
+
+    # Loaded resources, served from the cache. Callers must not modify them
+    def load_corpus(self, corpus_name):
+        paths = tuple(self.get_corpus(corpus_name))
+        compiled = os.path.join(self.compiled_corpora, corpus_name + ".corpus.npz")
+        return self.cache.get(("corpus", corpus_name), lambda: get_graphs(*paths, compiled=compiled),
+                              lambda graphs: 10 * file_size(*paths))  # parsed graphs take ~10x the text size
+
+    def load_lexicon(self, lexicon_name):
+        path = self.get_lexicon(lexicon_name)
+
+        def load():
+            lexicon = Lexicon()
+            lexicon.load_from_list(path)
+            return lexicon
+        return self.cache.get(("lexicon", lexicon_name), load, lambda lexicon: 10 * file_size(path))
+
+    def load_vsm(self, vsm_name):  # vsm_name is a file in vsm_folder, optionally with a :float16 or :int8 suffix
+        path = self.get_vsm(split_vsm_name(vsm_name)[0]) if vsm_name is not None else None
+        return self.cache.get(("vsm", vsm_name), lambda: VSM(path, compiled=self.prepare_vsm(vsm_name)),
+                              lambda vsm: vsm.matrix.nbytes if vsm.matrix is not None else 0)
+
+    def prepare_vsm(self, vsm_name):
+        """ Path of the derived VSM that load_vsm loads for vsm_name, created here if it doesn't exist yet
+            (e.g. once before the workers start), None if the VSM is loaded as it is """
+        name, precision = split_vsm_name(vsm_name) if vsm_name is not None else (None, "float32")
+        if name is None or (self.prune_corpora is None and precision == "float32"):
+            return None
+        if (name, precision) not in self.derived_vsm_paths:
+            self.derived_vsm_paths[(name, precision)] = self.get_derived_vsm(name, precision)
+        return self.derived_vsm_paths[(name, precision)]
+
+    def get_derived_vsm(self, vsm_name, precision):
+        """ Path of the binary VSM restricted to the vocabulary of prune_corpora (if set) and stored at the given
+            precision, created on first use. The name depends on the contents of the VSM and the corpora,
+            a change creates a new one """
+        path = self.get_vsm(vsm_name)
+        h = hashlib.sha1()
+        h.update(file_digest(path))
+        compiled = None
+        if self.prune_corpora is not None:
+            sentence_files = [list(self.get_corpus(corpus_name))[0] for corpus_name in self.prune_corpora]
+            for sentence_file in sentence_files:
+                h.update(file_digest(sentence_file))
+            compiled = os.path.join(self.derived_vsms, vsm_name + "." + h.hexdigest()[:16])
+            if not is_compiled_vsm(compiled):
+                prune_vsm(path, scan_vocabulary(sentence_files), compiled)
+        if precision != "float32":
+            quantized = os.path.join(self.derived_vsms, vsm_name + "." + h.hexdigest()[:16] + "." + precision)
+            if not is_compiled_vsm(quantized, scaled=precision == "int8"):
+                quantize_vsm(VSM(path, compiled=compiled), precision, quantized)
+            compiled = quantized
+        return compiled
+
+    def get_feature_key(self, mapper, corpus_name):
+        """ Content-based key of a feature matrix: corpus files, mapper class and settings, VSM and lexicon
+            None if the features can't be cached, e.g. for a lexicon built from training data """
+        lexicon, vsm = mapper.lexicon, mapper.vsm
+        if lexicon.path is None:
+            return None
+        h = hashlib.sha1()
+        h.update(str(FEATURE_CACHE_VERSION))
+        for path in self.get_corpus(corpus_name):
+            h.update(file_digest(path))
+        h.update(mapper.__class__.__name__)
+        h.update(str(mapper.multiword_averaging))
+        h.update(file_digest(vsm.path) if vsm.path is not None else "NA")
+        h.update(str(vsm.variant))
+        h.update(file_digest(lexicon.path))
+        h.update(repr(sorted(lexicon.frameToId.items())))  # frame ids are the labels
+        return h.hexdigest()
+
+    def get_matrix(self, mapper, corpus_name):
+        """ mapper.get_matrix for a corpus, stored on disk and memory-mapped on reuse. Any change of the
+            inputs changes the key, outdated entries are simply never read again """
+        return self.get_matrices([mapper], corpus_name)[0]
+
+    def get_matrices(self, mappers, corpus_name):
+        """ get_matrix for several mappers, the ones not in the cache are featurized together in one pass
+            over the corpus (representation.get_matrices) """
+        keys = [self.get_feature_key(mapper, corpus_name) for mapper in mappers]
+        matrices = [self.load_matrix(key) if key is not None else None for key in keys]
+        missing = [i for i in range(len(mappers)) if matrices[i] is None]
+        if len(missing) > 0:
+            computed = get_matrices([mappers[i] for i in missing], self.load_corpus(corpus_name))
+            for i, matrix in zip(missing, computed):
+                if keys[i] is not None:
+                    self.store_matrix(keys[i], matrix)
+                matrices[i] = matrix
+        return matrices
+
+    def has_matrix(self, mapper, corpus_name):  # the features of mapper for the corpus are in the cache
+        key = self.get_feature_key(mapper, corpus_name)
+        return key is not None and os.path.exists(os.path.join(self.feature_cache, key))
+
+    def load_matrix(self, key):  # cached (X, y, lemmapos, gid), None if missing
+        folder = os.path.join(self.feature_cache, key)
+        if not os.path.exists(folder):
+            return None
+        X = np.load(os.path.join(folder, "X.npy"), mmap_mode="r")
+        meta = np.load(os.path.join(folder, "meta.npz"))
+        return X, meta["y"], meta["lemmapos"].tolist(), meta["gid"].tolist()
+
+    def store_matrix(self, key, matrix):
+        X, y, lemmapos, gid = matrix
+        folder = os.path.join(self.feature_cache, key)
+        tmp_folder = folder + ".tmp%d" % os.getpid()
+        os.makedirs(tmp_folder)
+        np.save(os.path.join(tmp_folder, "X.npy"), X)
+        np.savez(os.path.join(tmp_folder, "meta.npz"), y=y, lemmapos=np.array(lemmapos, dtype=np.unicode_),
+                 gid=np.array(gid, dtype=np.int64))
+        try:
+            os.rename(tmp_folder, folder)
+        except OSError:  # another process was faster
+            shutil.rmtree(tmp_folder)
@@ -0,0 +1,321 @@
+import os
+import time
+import multiprocessing
+from collections import OrderedDict
+from numpy import random
+from evaluation import EvaluationResult
+from reporting import ResultReporter, ResultSummaryReporter, FrameReporter
+from resources import ResourceManager
+from classifier import load_classifier
+from instrumentation import Spans
+
+# Experiment scheduler: plans the train corpus x configuration x test corpus grid as per-model jobs (one training
+# and its evaluations) and runs them on a pool of worker processes. Each evaluation leaves its summary rows in
+# out/tasks, so an interrupted sweep can be resumed, and the rows are merged into the summary files
+# in plan order, independent of the order in which the workers finish.
+
+
+class Task(object):  # a training or an evaluation of the plan
+    def __init__(self, kind, name, deps=(), conf=None, corpus_train=None, corpus_test=None):
+        self.kind = kind  # train or evaluate
+        self.name = name
+        self.deps = list(deps)
+        self.conf = conf
+        self.corpus_train = corpus_train
+        self.corpus_test = corpus_test
+
+
+def get_task_id(conf, corpus_train, corpus_test, controller=None):  # same naming as the result files
+    task_id = corpus_train + "_" + corpus_test + "_" + str(conf)
+    if controller is not None and str(controller):
+        task_id += "__" + str(controller)
+    return task_id
+
+
+def get_task_paths(task_folder, task_id):
+    return {name: os.path.join(task_folder, task_id + "." + name) for name in ["summary", "summary_v", "summary_known", "spans", "done"]}
+
+
+def train(sources, conf, corpus_train, num_threads=None, spans=None, controller=None):
+    """ Load, featurize and train for one configuration, controller: classifier.TrainingController of the iterative classifiers """
+    spans = spans if spans is not None else Spans()
+    # go to configuration, check which lexicon is needed, locate the lexicon in FS, load the lexicon
+    # (or take it from the cache if a previous configuration already loaded it)
+    with spans.span("load_lexicon", corpus=corpus_train):
+        lexicon = sources.load_lexicon(conf.get_lexicon())
+
+    # same for VSM
+    with spans.span("load_vsm", corpus=corpus_train):
+        vsm = sources.load_vsm(conf.get_vsm())
+    mapper = conf.get_feat_extractor()(vsm, lexicon)
+
+    # prepare the data (or take it from the caches)
+    with spans.span("parse_corpus", corpus=corpus_train):
+        sources.load_corpus(corpus_train)
+    with spans.span("featurize", corpus=corpus_train):
+        X_train, y_train, lemmapos_train, gid_train = sources.get_matrix(mapper, corpus_train)
+
+    # train the model
+    with spans.span("train", corpus=corpus_train):
+        clf = conf.get_clf()(lexicon, conf.get_all_unknown(), conf.get_num_components(), conf.get_max_sampled(),
+                             conf.get_num_epochs(), num_threads, controller)
+        clf.train(X_train, y_train, lemmapos_train)
+
+    # keep the model for evaluation-only runs
+    path = sources.get_model(conf, corpus_train, controller)
+    if not os.path.exists(sources.models):
+        try:
+            os.makedirs(sources.models)
+        except OSError:  # created by another worker
+            pass
+    clf.save(path, conf)
+    return clf, mapper, lexicon
+
+
+def load_model(sources, conf, corpus_train, spans=None, controller=None):  # same as train, with the model saved by a previous training
+    spans = spans if spans is not None else Spans()
+    with spans.span("load_lexicon", corpus=corpus_train):
+        lexicon = sources.load_lexicon(conf.get_lexicon())
+    with spans.span("load_vsm", corpus=corpus_train):
+        vsm = sources.load_vsm(conf.get_vsm())
+    mapper = conf.get_feat_extractor()(vsm, lexicon)
+    with spans.span("load_model", corpus=corpus_train):
+        clf = load_classifier(sources.get_model(conf, corpus_train, controller), lexicon)
+    return clf, mapper, lexicon
+
+
+def evaluate(sources, conf, corpus_train, corpus_test, clf, mapper, lexicon, out, task_folder, compress=False,
+             train_spans=None, featurized=None, controller=None, pending=None):
+    """ Evaluate a trained model on a test corpus. The spans of this evaluation, and of the training if given,
+        go to the summary rows and to the task's span log. featurized: (wall, cpu) share of a joint featurization
+        of the test corpus (see Scheduler.featurize). pending: if given, the per-instance results are still written in
+        the background when this returns, (result reporter, done marker) is added to it and the caller closes the
+        reporter, then writes the marker (see finish_evaluations) """
+    spans = Spans(train_spans) if train_spans is not None else Spans()
+    if featurized is not None:
+        spans.add("featurize", featurized[0], featurized[1], corpus=corpus_test, joint=True)
+    start_time = time.time()
+    task_id = get_task_id(conf, corpus_train, corpus_test, controller)
+
+    # prepare test data
+    with spans.span("parse_corpus", corpus=corpus_test):
+        g_test = sources.load_corpus(corpus_test)
+    with spans.span("featurize", corpus=corpus_test):
+        X_test, y_test, lemmapos_test, gid_test = sources.get_matrix(mapper, corpus_test)
+
+    # predict and compare
+    with spans.span("predict", corpus=corpus_test):
+        y_predicted_test = clf.predict_batch(X_test, lemmapos_test)
+        result = EvaluationResult(y_predicted_test, y_test, lemmapos_test, lexicon)
+        score = result.score()  # all instances
+        score_v = result.score(result.pos == "v")  # verbs only
+        score_known = result.score(~result.unknown)  # known lemmas only
+
+    with spans.span("report", corpus=corpus_test):
+        result_reporter = ResultReporter(os.path.join(out, "results_" + task_id), compress)
+        for y_predicted, y_true, lemmapos, gid, g in zip(y_predicted_test, y_test, lemmapos_test, gid_test, g_test):
+            result_reporter.report(gid, g, lemmapos, y_predicted, y_true, lexicon)
+        frame_reporter = FrameReporter(os.path.join(out, "frames_" + task_id))
+        frame_reporter.report(result, lexicon)
+        frame_reporter.close()
+
+    # task outputs: one summary row per score and the span log, the "done" marker is written last
+    paths = get_task_paths(task_folder, task_id)
+    if os.path.exists(paths["done"]):  # a stale task run again
+        os.remove(paths["done"])
+    for name, s in [("summary", score), ("summary_v", score_v), ("summary_known", score_known)]:
+        reporter = ResultSummaryReporter(paths[name])
+        reporter.report(corpus_train, corpus_test, conf, s, time.time() - start_time, spans, clf.training)
+        reporter.close()
+    spans.write(paths["spans"], run=task_id)
+    if pending is not None:
+        pending += [(result_reporter, paths["done"])]
+    else:
+        finish_evaluations([(result_reporter, paths["done"])])
+
+
+def finish_evaluations(pending):  # the "done" marker of an evaluation is written once its results are on disk
+    for result_reporter, done in pending:
+        result_reporter.close()
+        open(done, "w").close()
+
+
+worker_sources = None  # per-process resource manager, its cache is kept between the jobs of a worker
+
+
+def init_worker(root, cache_budget, prune_corpora, derived_vsm_paths):
+    global worker_sources
+    worker_sources = ResourceManager(root, cache_budget, prune_corpora, derived_vsm_paths)
+
+
+def run_featurize(group):
+    """ Features of a corpus for several mappers with the same lexicon and VSM, computed in one pass into the
+        feature cache. Returns the names of the featurized mappers and the span of the pass """
+    lexicon_name, vsm_name, corpus, mapper_classes = group
+    lexicon, vsm = worker_sources.load_lexicon(lexicon_name), worker_sources.load_vsm(vsm_name)
+    mappers = [mapper_class(vsm, lexicon) for mapper_class in mapper_classes]
+    mappers = [mapper for mapper in mappers if worker_sources.get_feature_key(mapper, corpus) is not None and
+               not worker_sources.has_matrix(mapper, corpus)]
+    if len(mappers) < 2:  # nothing to share, the jobs featurize (or load) the features themselves
+        return [], None
+    spans = Spans()
+    with spans.span("featurize", corpus=corpus):
+        worker_sources.get_matrices(mappers, corpus)
+    return [mapper.__class__.__name__ for mapper in mappers], spans.records[0]
+
+
+def run_job(job):  # train (or load) one configuration and evaluate it on the pending test corpora
+    conf, corpus_train, corpora_test, out, task_folder, seed, evaluate_only, num_threads, compress, controller, \
+        featurized = job
+    random.seed(seed)  # same seed for every job, results don't depend on the order of execution
+    spans = Spans()  # shared by the evaluations of the job
+    if corpus_train in featurized and not evaluate_only:
+        spans.add("featurize", featurized[corpus_train][0], featurized[corpus_train][1], corpus=corpus_train, joint=True)
+    if evaluate_only:
+        clf, mapper, lexicon = load_model(worker_sources, conf, corpus_train, spans, controller)
+    else:
+        clf, mapper, lexicon = train(worker_sources, conf, corpus_train, num_threads, spans, controller)
+    pending = []  # the results are written while the next test sets are evaluated
+    try:
+        for corpus_test in corpora_test:
+            evaluate(worker_sources, conf, corpus_train, corpus_test, clf, mapper, lexicon, out, task_folder, compress, spans,
+                     featurized.get(corpus_test), controller, pending)
+    finally:
+        finish_evaluations(pending)
+    return conf, corpus_train, corpora_test
+
+
+class Scheduler:
+    def __init__(self, sources, reports, configs, corpora_train, corpora_test, workers=1, seed=4, evaluate_only=False,
+                 controller=None):
+        self.sources = sources
+        self.reports = reports
+        self.configs = configs
+        self.corpora_train = corpora_train
+        self.corpora_test = corpora_test
+        self.workers = workers
+        self.seed = seed
+        self.evaluate_only = evaluate_only  # use saved models instead of training
+        self.controller = controller  # early stopping of the iterative classifiers, see classifier.TrainingController
+        self.num_threads = max(1, multiprocessing.cpu_count() // workers)  # training threads per worker
+        self.task_folder = os.path.join(reports.report_folder, "tasks")
+        if not os.path.exists(self.task_folder):
+            os.makedirs(self.task_folder)
+        self.tasks = self.plan()
+
+    def plan(self):
+        """ Trainings and the evaluations depending on them, in the order of the original nested loops.
+            A training and its pending evaluations run as one job (see get_jobs) """
+        tasks = []
+        for corpus_train in self.corpora_train:
+            for conf in self.configs:
+                train_task = Task("train", os.path.basename(self.sources.get_model(conf, corpus_train, self.controller)),
+                                  [], conf, corpus_train)
+                tasks += [train_task]
+                for corpus_test in self.corpora_test:
+                    tasks += [Task("evaluate", get_task_id(conf, corpus_train, corpus_test, self.controller), [train_task],
+                                   conf, corpus_train, corpus_test)]
+        return tasks
+
+    def is_done(self, task):  # finished, with summaries in the current format (stale tasks are run again)
+        paths = get_task_paths(self.task_folder, task.name)
+        return os.path.exists(paths["done"]) and \
+            all(reporter.has_columns(paths[name]) for name, reporter in [("summary", self.reports.summary_reporter),
+                                                                         ("summary_v", self.reports.summary_reporter_v),
+                                                                         ("summary_known", self.reports.summary_reporter_known)])
+
+    def get_jobs(self):
+        """ Group the pending evaluations by the training they depend on: a trained model stays in the
+            worker process that produced it, so a training task and its evaluations form one job.
+            In evaluation-only mode, evaluations without a saved model are skipped """
+        jobs = []
+        pending = {}
+        for task in self.tasks:
+            if task.kind == "evaluate" and not self.is_done(task):
+                train_task = task.deps[0]
+                if self.evaluate_only and not os.path.exists(self.sources.get_model(task.conf, task.corpus_train, self.controller)):
+                    continue
+                if train_task not in pending:
+                    pending[train_task] = []
+                    jobs += [train_task]
+                pending[train_task] += [task.corpus_test]
+        return [(t.conf, t.corpus_train, pending[t], self.reports.report_folder, self.task_folder, self.seed,
+                 self.evaluate_only, self.num_threads, self.reports.compress, self.controller) for t in jobs]
+
+    def featurize(self, jobs, map_function):
+        """ Configurations that differ only in the mapper share one featurization pass per corpus: the passes run
+            as tasks on the workers (map_function) before the jobs, which then read the features from the cache.
+            Returns for each job {corpus: (wall, cpu)}, its share of the passes, reported in its featurize spans """
+        groups = OrderedDict()  # (lexicon, VSM, corpus) -> (mapper classes, [(job, mapper class)])
+        for i, job in enumerate(jobs):
+            conf, corpus_train, corpora_test = job[:3]
+            for corpus in (corpora_test if self.evaluate_only else [corpus_train] + corpora_test):
+                mapper_classes, users = groups.setdefault((conf.get_lexicon(), conf.get_vsm(), corpus), ([], []))
+                if conf.get_feat_extractor() not in mapper_classes:
+                    mapper_classes += [conf.get_feat_extractor()]
+                if (i, conf.get_feat_extractor()) not in users:
+                    users += [(i, conf.get_feat_extractor())]
+        joint = [(key + (mapper_classes,), users) for key, (mapper_classes, users) in groups.items() if len(mapper_classes) > 1]
+        shares = [{} for _ in jobs]
+        for (group, users), (featurized, record) in zip(joint, map_function(run_featurize, [group for group, _ in joint])):
+            if record is None:
+                continue
+            print "Featurized", group[2], "for", ", ".join(featurized), "in %.1fs" % record["wall_s"]
+            users = [i for i, mapper_class in users if mapper_class.__name__ in featurized]
+            for i in users:
+                shares[i][group[2]] = (record["wall_s"] / len(users), record["cpu_s"] / len(users))
+        return shares
+
+    def run(self):
+        evaluations = [task for task in self.tasks if task.kind == "evaluate"]
+        jobs = self.get_jobs()
+        print len(evaluations), "runs,", len(evaluations) - sum(len(job[2]) for job in jobs), "already done or without model,", \
+            len(jobs), "models to " + ("load" if self.evaluate_only else "train"), "on", self.workers, "worker(s)"
+
+        # graphs are written once per corpus, lexicons once per lexicon
+        for corpus in self.corpora_test + self.corpora_train:
+            reporter = self.reports.conll_reporter_train if corpus in self.corpora_train else self.reports.conll_reporter_test
+            reporter.report(self.sources.load_corpus(corpus))
+        for lexicon_name in sorted(set(conf.get_lexicon() for conf in self.configs)):
+            self.reports.lexicon_reporter.report(self.sources.load_lexicon(lexicon_name))
+        # pruned and quantized VSMs are derived once, here, instead of by every worker
+        for vsm_name in sorted(set(job[0].get_vsm() for job in jobs if job[0].get_vsm() is not None)):
+            self.sources.prepare_vsm(vsm_name)
+
+        pool = None
+        if self.workers > 1:
+            self.reports.flush()  # don't fork while the report writers hold locks
+            pool = multiprocessing.Pool(self.workers, init_worker, (self.sources.root, self.sources.cache.budget,
+                                                                 self.sources.prune_corpora, self.sources.derived_vsm_paths))
+        else:
+            global worker_sources
+            worker_sources = self.sources  # run in this process, share its cache
+        try:
+            shares = self.featurize(jobs, pool.map if pool is not None else map)
+            jobs = [job + (share,) for job, share in zip(jobs, shares)]
+            finished = pool.imap_unordered(run_job, jobs) if pool is not None else (run_job(job) for job in jobs)
+            for current, (conf, corpus_train, corpora_test) in enumerate(finished):
+                print "============ STATUS: - train", corpus_train, "conf", str(conf), \
+                    "test", len(corpora_test), "sets, job", current + 1, "/", len(jobs)
+            if pool is not None:
+                pool.close()
+                pool.join()
+        except:  # a failed job (or an interrupt) stops the others
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            raise
+        finally:
+            self.merge(evaluations)  # the runs that finished are kept in the summaries
+
+    def merge(self, evaluations):  # collect the task outputs into the summary files, in plan order
+        for task in evaluations:
+            if not self.is_done(task):  # skipped for lack of a saved model
+                continue
+            paths = get_task_paths(self.task_folder, task.name)
+            self.reports.summary_reporter.copy_rows(paths["summary"])
+            self.reports.summary_reporter_v.copy_rows(paths["summary_v"])
+            self.reports.summary_reporter_known.copy_rows(paths["summary_known"])
+            self.reports.span_reporter.copy_rows(paths["spans"])
+        self.reports.summary_reporter.flush()
+        self.reports.quantization_reporter.report(os.path.join(self.reports.report_folder, "summary"))
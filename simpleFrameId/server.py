@@ -0,0 +1,284 @@
+import os, sys, time, json, threading, Queue, SocketServer
+import numpy as np
+from collections import deque
+from numpy import random
+from globals import *
+from representation import DependentsBowMapper, SentenceBowMapper
+from classifier import SharingDNNClassifier, WsabieClassifier
+from config import Config
+from resources import ResourceManager
+from scheduler import train, load_model
+from data import parse_sentence_line
+from graph import Sentence, DependencyGraph
+
+# Serving mode: the classifier, lexicon, VSM and mapper are loaded once at startup (the model saved in ROOT/models
+# by a previous training, or trained now if there is none), then frames are
+# predicted for incoming requests. Requests arriving close together are grouped into micro-batches, featurized
+# and classified at once.
+#
+# Protocol: one JSON object per line, over stdin/stdout or a TCP connection on localhost
+#   request:  {"id": 1, "sentence": <line in .all.lemma.tags format>, "targets": [{"tids": [3], "lemmapos": "run.v"}]}
+#             instead of "sentence", "tokens": [{"form": "He", "dep": "nsubj", "head": 2}, ...] can be given
+#             token ids start at 1 (0 is the ROOT), as in the heads of the parse
+#   response: {"id": 1, "frames": ["Self_motion"]}, or {"id": 1, "error": "..."} for malformed requests
+#   {"stats": true} returns the latency and throughput counters
+
+HOME = "/home/local/UKP/martin/repos/frameID/"  # adjust accordingly
+CACHE_BUDGET = 8*1024**3
+CONFIG = Config(SharingDNNClassifier, DependentsBowMapper, LEXICON_FULL_BRACKETS_FIX, EMBEDDINGS_LEVY_DEPS_300,
+                False, False, None, None, None)  # configuration to serve
+CORPUS_TRAIN = CORPUS_DAS_TRAIN
+SEED = 4
+MAX_BATCH = 256  # maximum number of targets in one micro-batch
+MAX_LATENCY = 0.01  # seconds a request may wait for others to join its micro-batch
+HOST = "localhost"
+
+
+class ServerStats:  # latency and throughput counters, updated by the batching thread and read by the connection threads
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)  # seconds from arrival to response, of the last requests
+        self.requests = 0
+        self.instances = 0
+        self.batches = 0
+        self.start = time.time()
+
+    def consume(self, batch, now):
+        with self.lock:
+            self.batches += 1
+            for request in batch:
+                self.requests += 1
+                self.instances += len(request.graphs)
+                self.latencies.append(now - request.arrival)
+
+    def report(self):
+        with self.lock:  # consistent copy of the counters
+            latencies = list(self.latencies)
+            requests, instances, batches = self.requests, self.instances, self.batches
+        latencies = np.array(latencies) * 1000 if len(latencies) > 0 else np.zeros(1)
+        elapsed = time.time() - self.start
+        return {"requests": requests, "instances": instances, "batches": batches,
+                "avg_batch": float(instances) / batches if batches > 0 else 0.,
+                "p50_ms": float(np.percentile(latencies, 50)), "p99_ms": float(np.percentile(latencies, 99)),
+                "throughput": instances / elapsed if elapsed > 0 else 0.}
+
+
+class Request:
+    def __init__(self, request, respond):
+        self.arrival = time.time()
+        self.id = request.get("id")
+        self.request = request  # parsed JSON, turned into graphs by the batching thread
+        self.size = len(request["targets"])
+        self.graphs = []
+        self.respond = respond  # callback taking the response object
+        self.answered = False
+
+
+def request_to_graphs(request):  # parsed JSON request -> one graph per target, frames unknown
+    if "sentence" in request:
+        sentence = parse_sentence_line(request["sentence"].strip(), request.get("id"))
+        if sentence is None:
+            raise ValueError("malformed sentence")
+    else:
+        sentence = {tid + 1: token for tid, token in enumerate(request["tokens"])}
+    nodes = {tid: sentence[tid]["form"] for tid in sentence}
+    edges = [(int(sentence[tid]["head"]), tid, sentence[tid]["dep"]) for tid in sentence]
+    for head, tid, _ in edges:
+        if head != 0 and head not in nodes:
+            raise ValueError("head %d of token %d is not a token" % (head, tid))
+    parsed = Sentence(nodes, edges)
+    graphs = []
+    for target in request["targets"]:
+        tids = tuple(int(tid) for tid in target["tids"])
+        if len(tids) == 0 or any(tid not in nodes for tid in tids):
+            raise ValueError("target tids %s are not tokens" % (tids,))
+        g = DependencyGraph(parsed)
+        g.add_srl((tids, None, target["lemmapos"].lower()), {})
+        graphs += [g]
+    return graphs
+
+
+class FrameServer:
+    def __init__(self, clf, mapper, lexicon, max_batch=MAX_BATCH, max_latency=MAX_LATENCY):
+        self.clf = clf
+        self.mapper = mapper
+        self.lexicon = lexicon
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.queue = Queue.Queue()
+        self.stats = ServerStats()
+
+    def submit(self, line, respond):  # called by the connection threads, only the JSON is parsed there
+        try:
+            request = json.loads(line)
+        except ValueError:
+            respond({"error": "malformed JSON"})
+            return
+        if not isinstance(request, dict):
+            respond({"error": "malformed request: not a JSON object"})
+            return
+        if request.get("stats"):
+            respond({"id": request.get("id"), "stats": self.stats.report()})
+            return
+        if not isinstance(request.get("targets"), list):
+            respond({"id": request.get("id"), "error": "malformed request: no list of targets"})
+            return
+        self.queue.put(Request(request, respond))
+
+    def stop(self):
+        self.queue.put(None)
+
+    def next_batch(self):
+        """ Wait for a request, then collect more until the batch is full or the first request
+            has waited for max_latency. Returns (batch, stop) """
+        first = self.queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        size = first.size
+        deadline = first.arrival + self.max_latency
+        while size < self.max_batch:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=timeout)
+            except Queue.Empty:
+                break
+            if request is None:
+                return batch, True
+            batch += [request]
+            size += request.size
+        return batch, False
+
+    def process(self, batch):
+        for request in batch:  # graphs are built here, the connection threads never touch them
+            try:
+                request.graphs = request_to_graphs(request.request)
+            except Exception:
+                request.answered = True
+                request.respond({"id": request.id, "error": "malformed request: " + str(sys.exc_info()[1])})
+        batch = [request for request in batch if not request.answered]
+        graphs = [g for request in batch for g in request.graphs]
+        predicted = []
+        if len(graphs) > 0:
+            X = self.mapper.get_features(graphs)
+            predicted = self.clf.predict_batch(X, [g.lemmapos for g in graphs])
+        start = 0
+        now = time.time()
+        for request in batch:
+            frames = [self.lexicon.get_frame(y) for y in predicted[start:start + len(request.graphs)]]
+            start += len(request.graphs)
+            request.answered = True
+            request.respond({"id": request.id, "frames": frames})
+        self.stats.consume(batch, now)
+
+    def run(self):  # batching loop, runs in the main thread (the model was built there)
+        stop = False
+        while not stop:
+            batch, stop = self.next_batch()
+            if len(batch) > 0:
+                try:
+                    self.process(batch)
+                except Exception:  # fail this batch only, the server keeps running for the other clients
+                    error = "internal error: " + str(sys.exc_info()[1])
+                    print >> sys.stderr, "Batch failed:", error
+                    for request in batch:
+                        if not request.answered:
+                            request.answered = True
+                            request.respond({"id": request.id, "error": error})
+
+
+class ResponseWriter:  # thread-safe JSON lines writer for a stream, keeps track of the unanswered requests
+    def __init__(self, out):
+        self.out = out
+        self.pending = 0
+        self.lock = threading.Condition()
+
+    def submit(self, server, line):  # one bad line must not end the reading loop
+        with self.lock:
+            self.pending += 1
+        try:
+            server.submit(line, self.respond)
+        except Exception:
+            self.respond({"error": "internal error: " + str(sys.exc_info()[1])})
+
+    def respond(self, response):
+        line = json.dumps(response) + "\n"
+        with self.lock:
+            try:
+                self.out.write(line)
+                self.out.flush()
+            except IOError:  # the client is gone, nobody to answer
+                pass
+            finally:
+                self.pending -= 1
+                self.lock.notify_all()
+
+    def wait(self):  # until every submitted request is answered
+        with self.lock:
+            while self.pending > 0:
+                self.lock.wait()
+
+
+def serve_stdin(server, out):
+    writer = ResponseWriter(out)
+
+    def read():
+        try:
+            for line in iter(sys.stdin.readline, ""):
+                if line.strip():
+                    writer.submit(server, line)
+        finally:
+            server.stop()
+    reader = threading.Thread(target=read)
+    reader.daemon = True
+    reader.start()
+    server.run()
+
+
+def serve_socket(server, port):
+    class Handler(SocketServer.StreamRequestHandler):
+        def handle(self):
+            writer = ResponseWriter(self.wfile)
+            for line in iter(self.rfile.readline, ""):
+                if line.strip():
+                    writer.submit(server, line)
+            writer.wait()  # the stream is closed when the handler returns
+
+    class ThreadedServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+
+    tcp = ThreadedServer((HOST, port), Handler)
+    listener = threading.Thread(target=tcp.serve_forever)
+    listener.daemon = True
+    listener.start()
+    print >> sys.stderr, "Listening on", HOST, port
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    tcp.shutdown()
+
+
+if __name__ == "__main__":  # python server.py [port], without a port requests are read from stdin
+    # stdout carries the responses, progress goes to stderr
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    sources = ResourceManager(HOME, CACHE_BUDGET)
+    start_time = time.time()
+    if os.path.exists(sources.get_model(CONFIG, CORPUS_TRAIN)):
+        print "Loading", str(CONFIG), "trained on", CORPUS_TRAIN
+        clf, mapper, lexicon = load_model(sources, CONFIG, CORPUS_TRAIN)
+    else:
+        print "Training", str(CONFIG), "on", CORPUS_TRAIN
+        random.seed(SEED)
+        clf, mapper, lexicon = train(sources, CONFIG, CORPUS_TRAIN)
+    print "Ready after", time.time() - start_time, "s"
+    frame_server = FrameServer(clf, mapper, lexicon)
+    if len(sys.argv) > 1:
+        serve_socket(frame_server, int(sys.argv[1]))
+    else:
+        serve_stdin(frame_server, stdout)
+    print >> sys.stderr, json.dumps(frame_server.stats.report())